@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import tempfile
+from GeometricDataStructures.KmlFasade import KmlFasade
+from GeometricDataStructures.Mercator import MercatorProjection, LatLongPoint
+from RestrictionEngine.RestrictionEngine import RestrictionFactory
+
+DEFAULT_FILE = 'Inputs/KML Files/us_states.kml'
+VIEWPORTS = [(5, LatLongPoint(38.0, -74.0), 300), (4, LatLongPoint(41.0, -94.0), 300),
+             (6, LatLongPoint(40.0583, -74.4057), 600), (3, LatLongPoint(45.0, -60.0), 400)]
+ANTIMERIDIAN = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Placemark><Polygon><outerBoundaryIs><LinearRing><coordinates>170,0 -175,5 -175,-5 170,0</coordinates></LinearRing>
+</outerBoundaryIs></Polygon></Placemark>
+<Placemark><Polygon><outerBoundaryIs><LinearRing><coordinates>172,-3 -178,8 -170,-8 172,-3</coordinates></LinearRing>
+</outerBoundaryIs></Polygon></Placemark>
+</Document></kml>
+'''
+
+
+def legacyEntry(restriction, geometry):
+    """
+    `Author`: Bill Clark
+
+    The entry point search WAClippingRestriction.restrict used before findEntry, kept here to time against it.
+    Every transition into the viewport searches the coordinates again with index.
+
+    `return`: A tuple of the entry point's index and the number of coordinates outside.
+    """
+    last_pos = -1
+    startCoord = 0
+    outside = 0
+    for coordin in geometry.coordinates:
+        if not restriction.pointWithinCorners(coordin):
+            outside += 1
+            curr_pos = 0
+        else: curr_pos = 1
+
+        if last_pos == 0 and curr_pos == 1:
+            startCoord = geometry.coordinates.index(coordin)-1
+        last_pos = curr_pos
+    return startCoord, outside
+
+
+def timeEntries(entry, restrictions, geometrics, repeat):
+    """
+    `Author`: Bill Clark
+
+    `return`: The best time in seconds, out of repeat runs, for entry to run over every geometric in every viewport.
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for restriction in restrictions:
+            for geometry in geometrics:
+                entry(restriction, geometry)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(path=DEFAULT_FILE, repeat=5):
+    """
+    `Author`: Bill Clark
+
+    Times the entry point search of the Weiler Atherton restriction, the old index based loop against findEntry,
+    over the geometrics of a file with a few viewports. Both the list and the compact coordinate storage are timed.
+
+    `path`: The kml file to read.
+
+    `repeat`: How many times to run each, the best is reported.
+    """
+    projection = MercatorProjection()
+    factory = RestrictionFactory()
+    restrictions = [factory.newWAClipping(projection.get_corners(center, zoom, size, size))
+                    for zoom, center, size in VIEWPORTS]
+
+    for compact in (0, 1):
+        fasade = KmlFasade(path, compact=compact)
+        fasade.processPlacemarks()
+        geometrics = fasade.geometrics
+        vertices = sum(len(geometry.coordinates) for geometry in geometrics)
+
+        for restriction in restrictions:
+            for geometry in geometrics:
+                assert legacyEntry(restriction, geometry)[1] == restriction.findEntry(geometry)[1]
+
+        legacy = timeEntries(legacyEntry, restrictions, geometrics, repeat)
+        current = timeEntries(lambda restriction, geometry: restriction.findEntry(geometry),
+                              restrictions, geometrics, repeat)
+        print '%s: %d geometrics, %d vertices, %d viewports' % ('compact' if compact else 'list', len(geometrics),
+                                                                  vertices, len(restrictions))
+        print '  index loop: %8.2f ms' % (legacy * 1000)
+        print '  findEntry:  %8.2f ms  (%.1fx)' % (current * 1000, legacy / current if current else 0)
+
+
+def runRestrictions(path=DEFAULT_FILE, repeat=5):
+    """
+    `Author`: Bill Clark
+
+    Times the Weiler Atherton restriction against the rectangle clipping one, over the geometrics of a file with a
+    few viewports. Clipping changes the geometrics, so each run works on a freshly parsed file.
+
+    `path`: The kml file to read.
+
+    `repeat`: How many times to run each, the best is reported.
+    """
+    projection = MercatorProjection()
+    factory = RestrictionFactory()
+    viewports = [projection.get_corners(center, zoom, size, size) for zoom, center, size in VIEWPORTS]
+
+    for compact in (0, 1):
+        times = {}
+        for name, make in (('WAClipping', factory.newWAClipping), ('RectangleClipping', factory.newRectangleClipping)):
+            best = None
+            for _ in xrange(repeat):
+                fasades = []
+                for viewport in viewports:
+                    fasade = KmlFasade(path, compact=compact)
+                    fasade.processPlacemarks()
+                    fasades.append((make(viewport), fasade.geometrics))
+                start = time.time()
+                for restriction, geometrics in fasades:
+                    restriction.restrict(geometrics)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times[name] = best
+        print '%s restrictions, %d viewports' % ('compact' if compact else 'list', len(viewports))
+        print '  WAClipping:        %8.2f ms' % (times['WAClipping'] * 1000)
+        print '  RectangleClipping: %8.2f ms  (%.1fx)' % (times['RectangleClipping'] * 1000,
+                                                         times['WAClipping'] / times['RectangleClipping'])
+
+
+def checkClip():
+    """
+    `Author`: Bill Clark
+
+    Checks that clip leaves its source alone, with polygons that cross the anti-meridian, where the Weiler
+    Atherton clip shifts the points it's given. The file is clipped twice to each of two viewports, in both
+    orders, with both coordinate storages. Every clip has to give the same result and the source has to keep its
+    coordinates, without sharing a point with any result.
+    """
+    path = tempfile.mktemp('.kml')
+    with open(path, 'w') as output:
+        output.write(ANTIMERIDIAN)
+    projection = MercatorProjection()
+    factory = RestrictionFactory()
+    viewports = [projection.get_corners(LatLongPoint(0, 168), 6, 600, 600),
+                 projection.get_corners(LatLongPoint(-4, 172), 7, 600, 600)]
+    try:
+        for compact in (0, 1):
+            fasade = KmlFasade(path, compact=compact)
+            fasade.processPlacemarks()
+            source = [[str(point) for point in geometry.coordinates] for geometry in fasade.geometrics]
+            results = {}
+            for order in (viewports, viewports[::-1], viewports):
+                for viewport in order:
+                    result = factory.newWAClipping(viewport).clip(fasade.geometrics)
+                    clipped = [[str(point) for point in geometry.coordinates] for geometry in result]
+                    assert results.setdefault(id(viewport), clipped) == clipped
+                    assert source == [[str(point) for point in geometry.coordinates] for geometry in fasade.geometrics]
+                    if not compact:
+                        points = set(id(point) for geometry in fasade.geometrics for point in geometry.coordinates)
+                        assert not any(id(point) in points for geometry in result for point in geometry.coordinates)
+        print 'clip left the source untouched over the anti-meridian'
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    checkClip()
+    run(*sys.argv[1:2])
+    runRestrictions(*sys.argv[1:2])
@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from PIL import Image, ImageDraw
+import StaticMapsConnections.ImageMerge as ImageMerge
+
+
+def makeImages(directory, layers=4, size=600):
+    """
+    `Author`: Bill Clark
+
+    Draws a stand in for a static maps run, a noisy base image and layers of it with lines drawn over the top,
+    saved in P mode like the downloads.
+
+    `directory`: The folder to save the images to.
+
+    `layers`: The number of layers to draw.
+
+    `size`: The width and height of the images in pixels.
+
+    `return`: A tuple of the base image's path and a list of the layers' paths.
+    """
+    rand = random.Random(0)
+    base = Image.new('RGB', (size, size))
+    draw = ImageDraw.Draw(base)
+    for _ in xrange(400):
+        x, y = rand.randrange(size), rand.randrange(size)
+        draw.rectangle([x, y, x + 40, y + 40], fill=(rand.randrange(180, 256), rand.randrange(180, 256), 200))
+    basePath = os.path.join(directory, 'image 0.png')
+    base.convert('P').save(basePath)
+
+    ret = []
+    for layer in xrange(1, layers + 1):
+        image = base.copy()
+        draw = ImageDraw.Draw(image)
+        points = [(rand.randrange(size), rand.randrange(size)) for _ in xrange(60)]
+        draw.line(points, fill=(0, 0, 255) if layer % 2 else (255, 0, 0), width=5)
+        path = os.path.join(directory, 'image {}.png'.format(layer))
+        image.convert('P').save(path)
+        ret.append(path)
+    return basePath, ret
+
+
+def run(layers=4, repeat=3):
+    """
+    `Author`: Bill Clark
+
+    Times a layer merge pixel by pixel against the NumPy arrays, over generated images, and checks both give the
+    same output.
+
+    `layers`: The number of layers merged.
+
+    `repeat`: How many times to run each, the best is reported.
+    """
+    if ImageMerge.numpy is None:
+        print 'NumPy is not installed, only the pixel by pixel merge is available.'
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        basePath, paths = makeImages(directory, layers)
+        merger = ImageMerge.Merger(os.path.join(directory, 'out.png'), basePath)
+        tops = [Image.open(path) for path in merger.convertAll(*paths)]
+        for top in tops:
+            top.load()
+
+        results = {}
+        for name, overlay in (('pixels', merger.overlayPixels), ('arrays', merger.overlayArrays)):
+            best = None
+            for _ in xrange(repeat):
+                tracked = merger.baseimage.copy()
+                start = time.time()
+                for top in tops:
+                    tracked, counter = overlay(tracked, top)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, tracked.tobytes())
+
+        print '%d layers of %dx%d' % (layers, merger.baseimage.size[0], merger.baseimage.size[1])
+        print '  pixel by pixel: %8.2f ms a layer' % (results['pixels'][0] * 1000 / layers)
+        print '  numpy arrays:   %8.2f ms a layer  (%.1fx)' % (results['arrays'][0] * 1000 / layers,
+                                                               results['pixels'][0] / results['arrays'][0])
+        print '  same output:   ', results['pixels'][1] == results['arrays'][1]
+    finally:
+        shutil.rmtree(directory)
+
+
+def runParallel(layers=32, processes=4, size=1200, repeat=3):
+    """
+    `Author`: Bill Clark
+
+    Times MemoryMerger.mergeAll in this process against shared across a pool, over generated image data, and checks
+    both give the same output.
+
+    `layers`: The number of layers merged.
+
+    `processes`: The number of processes in the pool.
+
+    `size`: The width and height of the images in pixels.
+
+    `repeat`: How many times to run each, the best is reported.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        basePath, paths = makeImages(directory, layers, size)
+        base = open(basePath, 'rb').read()
+        images = [open(path, 'rb').read() for path in paths]
+
+        results = {}
+        for count in (1, processes):
+            best = None
+            for _ in xrange(repeat):
+                start = time.time()
+                merger = ImageMerge.MemoryMerger(base, count)
+                merger.mergeAll(*images)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[count] = (best, merger.trackedimage.tobytes())
+
+        print '%d layers of %dx%d' % (layers, size, size)
+        print '  1 process:     %8.2f ms' % (results[1][0] * 1000)
+        print '  %d processes:   %8.2f ms  (%.1fx)' % (processes, results[processes][0] * 1000,
+                                                      results[1][0] / results[processes][0])
+        print '  same output:   ', results[1][1] == results[processes][1]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':  # Arguments: the layers of the serial run, then the processes of the parallel one.
+    run(*[int(arg) for arg in sys.argv[1:2]])
+    runParallel(processes=int(sys.argv[2]) if len(sys.argv) > 2 else 4)
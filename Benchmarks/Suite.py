@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import StaticMapsConnections.ImageMerge as ImageMerge
+from GeometricDataStructures.KmlFasade import KmlFasade
+from GeometricDataStructures.Mercator import MercatorProjection
+from RestrictionEngine.RestrictionEngine import RestrictionFactory
+from StaticMapsConnections.UrlBuilder import UrlBuilder
+from Benchmarks.ClippingBenchmark import VIEWPORTS
+from Benchmarks.MergeBenchmark import makeImages
+
+FILES = ['us_states', 'advancedexample2', 'advancedexample3', 'Iceberg Warnings']
+DIRECTORY = os.path.join('Inputs', 'KML Files')
+BASELINE = os.path.join('Benchmarks', 'baseline.json')
+TOLERANCE = 0.25  # How much slower than the baseline a case may run before it's reported, as a fraction.
+FLOOR = 0.002  # Seconds a case must slow by to be reported, the quickest cases are mostly noise.
+
+
+def best(work, repeat, setup=None):
+    """
+    `Author`: Bill Clark
+
+    Times a piece of work, leaving its setup out of the time.
+
+    `work`: The function to time. Called with what setup returns, if there is a setup.
+
+    `repeat`: How many times to run it.
+
+    `setup`: A function run before each timing, to make what the work changes. Optional.
+
+    `return`: The best time in seconds.
+    """
+    ret = None
+    for _ in xrange(repeat):
+        state = setup() if setup is not None else None
+        start = time.time()
+        work(state) if setup is not None else work()
+        elapsed = time.time() - start
+        ret = elapsed if ret is None else min(ret, elapsed)
+    return ret
+
+
+def restrictions(zoom, viewport):
+    """
+    `Author`: Bill Clark
+
+    `return`: A list of tuples of each restriction type's name and a new one for the viewport.
+    """
+    factory = RestrictionFactory()
+    return [('WAClipping', factory.newWAClipping(viewport)),
+            ('SquareRestriction', factory.newSquareRestriction(viewport)),
+            ('RectangleClipping', factory.newRectangleClipping(viewport)),
+            ('Simplification', factory.newSimplification(zoom))]
+
+
+def runFile(path, repeat):
+    """
+    `Author`: Bill Clark
+
+    Times every stage of a run over one file: parsing, making the geometrics, each restriction type, the rewrite
+    and building the urls, plain and encoded. The restrictions, rewrite and urls are summed over the viewports,
+    each working on a fresh copy of the parsed file.
+
+    `path`: The kml file.
+
+    `repeat`: How many times to run each case, the best is kept.
+
+    `return`: A dict of the seconds each case took, by name.
+    """
+    ret = {}
+    projection = MercatorProjection()
+    ret['parse'] = best(lambda: KmlFasade(path), repeat)
+    ret['processPlacemarks'] = best(lambda fasade: fasade.processPlacemarks(), repeat, lambda: KmlFasade(path))
+
+    fasade = KmlFasade(path)
+    fasade.processPlacemarks()
+    fasade.removeGarbageTags()
+    output = tempfile.mktemp('.kml')
+    try:
+        for zoom, center, size in VIEWPORTS:
+            viewport = projection.get_corners(center, zoom, size, size)
+            for name, restriction in restrictions(zoom, viewport):
+                ret[name] = ret.get(name, 0) + best(lambda view: restriction.restrict(view.geometrics), repeat,
+                                                    fasade.copy)
+
+            clipped = fasade.copy()
+            RestrictionFactory().newRectangleClipping(viewport).restrict(clipped.geometrics)
+            clipped.fasadeUpdate()
+
+            def urls(encode):
+                build = UrlBuilder(size, encode=encode)
+                build.centerparams(repr(center), repr(zoom))
+                build.addGeometrics(clipped.geometrics)
+
+            ret['rewrite'] = ret.get('rewrite', 0) + best(lambda: clipped.rewrite(output), repeat)
+            ret['urls'] = ret.get('urls', 0) + best(lambda: urls(0), repeat)
+            ret['urlsEncoded'] = ret.get('urlsEncoded', 0) + best(lambda: urls(1), repeat)
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+    return ret
+
+
+def runMerge(repeat, layers=8, size=600):
+    """
+    `Author`: Bill Clark
+
+    Times merging a set of fixture images, made by MergeBenchmark.makeImages in place of downloads.
+
+    `repeat`: How many times to merge them, the best is kept.
+
+    `layers`: The number of layers to merge.
+
+    `size`: The width and height of the images in pixels.
+
+    `return`: A dict of the seconds the merge took.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        basePath, paths = makeImages(directory, layers, size)
+        base = open(basePath, 'rb').read()
+        images = [open(path, 'rb').read() for path in paths]
+        return {'merge': best(lambda: ImageMerge.MemoryMerger(base).mergeAll(*images), repeat)}
+    finally:
+        shutil.rmtree(directory)
+
+
+def run(repeat=3, files=FILES):
+    """
+    `Author`: Bill Clark
+
+    Runs the whole suite.
+
+    `repeat`: How many times to run each case, the best is kept.
+
+    `files`: The names of the files in Inputs/KML Files to run over.
+
+    `return`: The results, a dict of a description of the machine and the seconds of each case, by file and case
+              name joined with a slash.
+    """
+    results = {}
+    for name in files:
+        for case, seconds in runFile(os.path.join(DIRECTORY, name + '.kml'), repeat).items():
+            results[name + '/' + case] = seconds
+    results.update(runMerge(repeat))
+    machine = {'python': platform.python_version(), 'platform': platform.platform(),
+               'processor': platform.machine(), 'numpy': ImageMerge.numpy is not None, 'repeat': repeat,
+               'viewports': len(VIEWPORTS)}
+    return {'machine': machine, 'results': results}
+
+
+def compare(current, baseline, tolerance=TOLERANCE):
+    """
+    `Author`: Bill Clark
+
+    Prints each case against the baseline. Timings only compare on like machines, a difference in the machine
+    descriptions is printed first. A case is only reported slower if it also lost more than FLOOR seconds.
+
+    `current`: Results from run.
+
+    `baseline`: Results from an earlier run.
+
+    `tolerance`: How much slower than the baseline a case may run before it's reported, as a fraction.
+
+    `return`: A list of the names of the cases slower than the tolerance allows.
+    """
+    for key in sorted(set(current['machine']) | set(baseline['machine'])):
+        if current['machine'].get(key) != baseline['machine'].get(key):
+            print 'machine differs, %s: %s baseline, %s now' % (key, baseline['machine'].get(key),
+                                                                 current['machine'].get(key))
+    ret = []
+    print '%-40s%12s%12s%8s' % ('case', 'baseline ms', 'now ms', 'ratio')
+    for name in sorted(current['results']):
+        now = current['results'][name]
+        before = baseline['results'].get(name)
+        if before is None:
+            print '%-40s%12s%12.2f%8s' % (name, '-', now * 1000, 'new')
+            continue
+        ratio = now / before if before else 0
+        slower = ratio > 1 + tolerance and now - before > FLOOR
+        if slower:
+            ret.append(name)
+        print '%-40s%12.2f%12.2f%8.2f%s' % (name, before * 1000, now * 1000, ratio, '  SLOWER' if slower else '')
+    return ret
+
+
+def main(args=None):
+    """
+    `Author`: Bill Clark
+
+    Runs the suite from the command line. Run from the repository root, as python -m Benchmarks.Suite. The results
+    are compared to the baseline if there is one, and the exit status is 1 if any case got slower than the
+    tolerance allows.
+
+    `args`: The command line arguments, sys.argv if not given.
+    """
+    parser = argparse.ArgumentParser(description='Times the stages of a run over the bundled kml files.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, the best is kept')
+    parser.add_argument('--output', help='write the results as json to this path')
+    parser.add_argument('--baseline', default=BASELINE, help='the results to compare against')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slow down, as a fraction')
+    options = parser.parse_args(args)
+
+    results = run(options.repeat)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    regressions = []
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), options.tolerance)
+    else:
+        print 'No baseline at %s.' % options.baseline
+        for name in sorted(results['results']):
+            print '%-40s%12.2f ms' % (name, results['results'][name] * 1000)
+
+    if options.save:
+        with open(options.baseline, 'w') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+        print 'Baseline saved to %s.' % options.baseline
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import ClippingBenchmark
+import MergeBenchmark
+import Suite
+
+__all__ = ["ClippingBenchmark", "MergeBenchmark", "Suite"]
@@ -1,14 +1,22 @@
+import copy
 from lxml import etree
+from array import array
 
-class LatLongPoint:
+class LatLongPoint(object):
     """
     Author: Nick LaPosta, Bob Seedorf, Bill Clark
 
     Container for the lat/lon coordinate for a point on a Mercator map projection.
     GeoLatLng has a wrap around for the anti-meridian so that it never has a longitude > 180 or < -180
 
+    Points are slotted value types. Each carries a key, its lat and long as integers in units of 1e-7 degrees,
+    which equality and hashing use, so points can be looked up in dicts and sets. Any change to the coordinates
+    must go through rewrap or shift so the key follows.
+
     NOTE this implementation may not work, I am changing it to suit a test -Bob 4-23-16
     """
+    __slots__ = ('lat', 'lng', 'key')
+
     def __init__(self, lt, ln):
         """
         Initializes the lat long point with the given lat and long, rounded to seven places.
@@ -50,13 +58,27 @@ class LatLongPoint:
     def __eq__(self, other):
         """
         Inbuilt equality check. checks the contained lat long values to be equal to the other object.
-        This, as opposed to cmp, reinforces each value is rounded to 7 digits.
+        The comparison is on the pre-rounded integer keys, which is the same as comparing each value
+        rounded to 7 digits.
 
         :param other: Another LatLongPoint.
 
         :return: True if the points are equal.
         """
-        return (round(self.lat,7) == round(other.lat,7) and round(self.lng,7) == round(other.lng,7))
+        return self.key == getattr(other, 'key', None)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __getstate__(self):
+        return (self.lat, self.lng)
+
+    def __setstate__(self, state):
+        self.lat, self.lng = state
+        self.setKey()
 
     def __getitem__(self, item):
         return self;
@@ -74,6 +96,33 @@ class LatLongPoint:
             self.lng = self.lng - 360
         else:
             self.lng = self.lng
+        self.setKey()
+
+    def shift(self, degrees):
+        """
+        Moves the point along the longitude axis without wrapping it. Used to unwrap lines over the anti-meridian.
+
+        :param degrees: The number of degrees to add to the longitude.
+        """
+        self.lng = self.lng + degrees
+        self.setKey()
+
+    def copy(self):
+        """
+        Makes a new point with the same values, without rounding or wrapping them again, so a point shifted over
+        the anti-meridian copies as it is.
+
+        :return: The new LatLongPoint.
+        """
+        ret = LatLongPoint.__new__(LatLongPoint)
+        ret.lat, ret.lng, ret.key = self.lat, self.lng, self.key
+        return ret
+
+    def setKey(self):
+        """
+        Recomputes the key used for equality and hashing, the lat and long in integer units of 1e-7 degrees.
+        """
+        self.key = (int(round(self.lat * 10000000)), int(round(self.lng * 10000000)))
 
     def getTup(self):
         """
@@ -102,6 +151,165 @@ class LatLongPoint:
         return [self.lat, self.lng]
 
 
+class CoordinateArray(object):
+    """
+    `Author`: Bill Clark
+
+    The compact coordinate backend for geometric objects. Every lng, lat pair is held in one contiguous float64
+    array instead of one LatLongPoint per vertex, which is an order of magnitude less memory on large polygons.
+    It acts like the list of LatLongPoints it replaces; indexing and iterating create the points on demand, slices
+    and concatenation stay compact, and assigning points into it packs them back down.
+    """
+
+    def __init__(self, values=None):
+        """
+        `Author`: Bill Clark
+
+        Wraps an array of coordinates.
+
+        `values`: An array('d') of alternating lng, lat values. Defaults to empty.
+        """
+        self.values = values if values is not None else array('d')
+
+    @classmethod
+    def fromText(cls, text):
+        """
+        `Author`: Bill Clark
+
+        Parses the text of a kml coordinates tag in one pass. Every number is split out and converted at once, then
+        the altitudes, if the file has them, are sliced away. Values are rounded to seven places as LatLongPoint
+        rounds them, so both backends write the same coordinates.
+
+        `text`: The coordinates text, whitespace separated lng,lat[,alt] tuples.
+
+        `return`: A new CoordinateArray.
+        """
+        tuples = text.split()
+        if not tuples:
+            return cls()
+        stride = tuples[0].count(',') + 1
+        flat = text.replace(',', ' ').split()
+        if len(flat) == stride * len(tuples):
+            numbers = array('d', [round(float(x), 7) for x in flat])
+            if stride == 2:
+                values = numbers
+            else:
+                values = array('d', [0.0]) * (2 * len(tuples))
+                values[0::2] = numbers[0::stride]
+                values[1::2] = numbers[1::stride]
+        else:  # Mixed tuples, some with altitudes and some without.
+            values = array('d')
+            for x in tuples:
+                s = x.split(',')
+                values.append(round(float(s[0]), 7))
+                values.append(round(float(s[1]), 7))
+
+        ret = cls(values)
+        lngs = values[0::2]
+        if min(lngs) < -180 or max(lngs) > 180:  # Wrap the same way LatLongPoint would.
+            for i in xrange(0, len(values), 2):
+                values[i] = LatLongPoint(values[i + 1], values[i]).lng
+        return ret
+
+    @classmethod
+    def pack(cls, points):
+        """
+        `Author`: Bill Clark
+
+        Packs LatLongPoints, or another CoordinateArray, into a new CoordinateArray.
+
+        `points`: An iterable of LatLongPoints.
+
+        `return`: A new CoordinateArray.
+        """
+        if isinstance(points, CoordinateArray):
+            return cls(array('d', points.values))
+        values = array('d')
+        for point in points:
+            values.append(point.lng)
+            values.append(point.lat)
+        return cls(values)
+
+    def __len__(self):
+        return len(self.values) // 2
+
+    def __iter__(self):
+        values = self.values
+        for i in xrange(0, len(values), 2):
+            yield LatLongPoint(values[i + 1], values[i])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return CoordinateArray(self.values[2 * start:2 * max(start, stop)])
+            return CoordinateArray.pack([self[i] for i in xrange(start, stop, step)])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('coordinate index out of range')
+        return LatLongPoint(self.values[2 * index + 1], self.values[2 * index])
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('CoordinateArray only supports contiguous slice assignment.')
+            self.values[2 * start:2 * max(start, stop)] = CoordinateArray.pack(value).values
+        else:
+            if index < 0:
+                index += len(self)
+            self.values[2 * index] = value.lng
+            self.values[2 * index + 1] = value.lat
+
+    def __add__(self, other):
+        return CoordinateArray(self.values + CoordinateArray.pack(other).values)
+
+    def __radd__(self, other):
+        return CoordinateArray(CoordinateArray.pack(other).values + self.values)
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def append(self, point):
+        self.values.append(point.lng)
+        self.values.append(point.lat)
+
+    def index(self, point):
+        """
+        `Author`: Bill Clark
+
+        The list index method. Returns the position of the first coordinate equal to the given point.
+
+        `point`: A LatLongPoint.
+
+        `return`: The index of the point. Raises ValueError when it isn't contained.
+        """
+        for i, coordinate in enumerate(self):
+            if coordinate == point:
+                return i
+        raise ValueError('point is not in the coordinates')
+
+    def lngs(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: An array of every longitude, in order.
+        """
+        return self.values[0::2]
+
+    def lats(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: An array of every latitude, in order.
+        """
+        return self.values[1::2]
+
+
 class GeometricObject(object):
 
     def __str__(self):
@@ -116,7 +324,7 @@ class GeometricObject(object):
 
         return str(self.tag)+ ' ' + self.printCoordinates() + " " + elementPrint(self.element)
 
-    def __init__(self, element, tag, coordinates):
+    def __init__(self, element, tag, coordinates, compact=0):
         """
         `Author`: Bill Clark
 
@@ -129,19 +337,27 @@ class GeometricObject(object):
         `tag`: The tag value, otherwise the type of the element.
 
         `coordinates`: the coordinate values for the tag, pulled out of the xml for easy of access.
+
+        `compact`: flag to store the coordinates in a CoordinateArray rather than a list of LatLongPoints.
         """
 
         self.element = element
         self.tag = tag
         self.remove = 0
         self.debug = 0
+        self.pixels = {}  # Projected pixel coordinates by zoom, see pixelCoordinates.
+        self.bounds = None
+        self.pieces = []  # Coordinates of any further pieces a restriction split this geometry into, see setPieces.
         self.coordinates = []  # Most definitely required.
-        if type(coordinates) is str:
+        if type(coordinates) is str and compact:
+            self.coordinates = CoordinateArray.fromText(coordinates)
+        elif type(coordinates) is str:
             for x in coordinates.split():
                 s = x.split(',')
                 self.coordinates.append(LatLongPoint(float(s[1]), float(s[0])))
         else:
             self.coordinates = coordinates
+        self.setBounds()
         if self.debug: print self.coordinates
 
     def applyEdits(self):
@@ -151,13 +367,110 @@ class GeometricObject(object):
         This is the super method for all applyEdit methods. This method and it's children are used to take the changes
         made to the pulled out xml values and apply them back to the file object. Here we slat ee the geometrics with their
         remove flag set being removed from the tag above them, and the lat long coordinates being rewritten.
+
+        `return`: A list of any new geometrics the edits made, see LineString.
         """
         if self.remove == len(self.coordinates):
             y = self.element.getparent()
             if y is not None: y.remove(self.element)
         else:
-            self.element.find('coordinates').text = '\n'.join([x.rewriteStr() for x in self.coordinates])
+            coordinatesTag = qualify('coordinates', etree.QName(self.element).namespace)
+            self.element.find(coordinatesTag).text = '\n'.join([x.rewriteStr() for x in self.coordinates])
+        return []
+
+    def setCoordinates(self, coordinates):
+        """
+        `Author`: Bill Clark
+
+        Replaces the coordinates of this object, in place, and drops everything cached off the old ones. Restrictions
+        should change coordinates through this method.
+
+        `coordinates`: The new coordinates, a list of LatLongPoints or a CoordinateArray.
+        """
+        self.coordinates[:] = coordinates
+        self.pixels = {}
+        self.setBounds()
+
+    def copy(self, element):
+        """
+        `Author`: Bill Clark
+
+        Makes a copy of this geometric around another element, with coordinates of its own, so that restricting
+        and applying edits to the copy leaves this one untouched. The points are copied as well as the list, the
+        Weiler Atherton clip shifts and rewraps the points it's given in place. Used by KmlFasade.copy.
+
+        `element`: The element the copy wraps, the copy of this one's element. None for a copy detached from any
+                   xml, which can be pickled.
+
+        `return`: The new geometric.
+        """
+        ret = copy.copy(self)
+        ret.element = element
+        ret.coordinates = copyPoints(self.coordinates)
+        ret.pixels = dict(self.pixels)
+        ret.pieces = [copyPoints(piece) for piece in self.pieces]
+        return ret
+
+    def setPieces(self, pieces):
+        """
+        `Author`: Bill Clark
+
+        Replaces the coordinates of this object with the result of a clip that may have split it. The first piece
+        becomes this object's coordinates, the rest are held until applyEdits writes them out. Clears the remove
+        flag, the pieces are what's left to keep.
+
+        `pieces`: A list of at least one piece, each a list of LatLongPoints.
+        """
+        self.setCoordinates(pieces[0])
+        self.pieces = pieces[1:]
+        self.remove = 0
+
+    def setBounds(self):
+        """
+        `Author`: Bill Clark
+
+        Computes and caches the bounding box of the coordinates, so that restrictions can accept or reject the whole
+        geometry without looking at its vertices. Called on creation and by setCoordinates.
+
+        `return`: The bounds as a tuple of west, south, east, north. None when there are no coordinates.
+        """
+        if len(self.coordinates) == 0:
+            self.bounds = None
+        else:
+            lats, lngs = self.latLngArrays()
+            self.bounds = (min(lngs), min(lats), max(lngs), max(lats))
+        return self.bounds
+
+    def latLngArrays(self):
+        """
+        `Author`: Bill Clark
+
+        Returns the coordinates split into a sequence of latitudes and one of longitudes, for the batch projections.
+        A CoordinateArray hands over slices of its array without making any points.
+
+        `return`: A tuple of the latitudes and the longitudes.
+        """
+        if isinstance(self.coordinates, CoordinateArray):
+            return self.coordinates.lats(), self.coordinates.lngs()
+        return [x.lat for x in self.coordinates], [x.lng for x in self.coordinates]
+
+    def pixelCoordinates(self, projection, zoom):
+        """
+        `Author`: Bill Clark
+
+        Returns the coordinates projected to pixel space for the zoom, projecting the whole geometry in one batch call
+        the first time and answering from the cache after that.
+
+        `projection`: A MercatorProjection.
 
+        `zoom`: The zoom level of the pixel space.
+
+        `return`: A tuple of the x and the y pixel coordinates.
+        """
+        if zoom not in self.pixels:
+            lats, lngs = self.latLngArrays()
+            self.pixels[zoom] = projection.from_lat_lng_arrays_to_points(lats, lngs, zoom)
+        return self.pixels[zoom]
 
     def printCoordinates(self):
         """
@@ -195,8 +508,8 @@ class Point(GeometricObject):
     See Geometric Object. This class specifies rules for a point xml object.
     """
 
-    def __init__(self, element, tag, coordinates):
-        super(Point, self).__init__(element, tag, coordinates)
+    def __init__(self, element, tag, coordinates, compact=0):
+        super(Point, self).__init__(element, tag, coordinates, compact)
 
     def applyEdits(self):
         """
@@ -206,7 +519,7 @@ class Point(GeometricObject):
         point, the point will be removed from the file. This removal is done from the Placemark containing the point.
         """
 
-        super(Point,self).applyEdits()
+        return super(Point,self).applyEdits()
 
     def printCoordinates(self):
         return str(self.coordinates[0])
@@ -222,11 +535,11 @@ class LinearRing(GeometricObject):
     See Geometric Object. This class specifies rules for a linearring xml object.
     """
 
-    def __init__(self, element, tag, coordinates):
-        super(LinearRing, self).__init__(element, tag, coordinates)
+    def __init__(self, element, tag, coordinates, compact=0):
+        super(LinearRing, self).__init__(element, tag, coordinates, compact)
 
     def applyEdits(self):
-        super(LinearRing,self).applyEdits()
+        return super(LinearRing,self).applyEdits()
 
 
 class LineString(GeometricObject):
@@ -236,11 +549,44 @@ class LineString(GeometricObject):
     See Geometric Object. This class specifies rules for a LineString xml object.
     """
 
-    def __init__(self, element, tag, coordinates):
-        super(LineString, self).__init__(element, tag, coordinates)
+    def __init__(self, element, tag, coordinates, compact=0):
+        super(LineString, self).__init__(element, tag, coordinates, compact)
 
     def applyEdits(self):
-        super(LineString,self).applyEdits()
+        """
+        `Author`: Bill Clark
+
+        See geometric object. A line that was split into pieces is rewritten as one LineString per piece, copies of
+        the original so they keep its other tags. The copies are placed alongside it in its MultiGeometry, or a
+        MultiGeometry is made to hold them if the line sits directly in a placemark.
+
+        `return`: The new LineStrings made for the pieces after the first.
+        """
+        ret = super(LineString,self).applyEdits()
+        if not self.pieces or self.remove == len(self.coordinates):
+            return ret
+
+        namespace = etree.QName(self.element).namespace
+        coordinatesTag = qualify('coordinates', namespace)
+        multiTag = qualify('MultiGeometry', namespace)
+        parent = self.element.getparent()
+        if parent.tag != multiTag:
+            multi = parent.makeelement(multiTag, {})
+            parent.replace(self.element, multi)
+            multi.append(self.element)
+            parent = multi
+
+        position = parent.index(self.element)
+        for piece in self.pieces:
+            element = copy.deepcopy(self.element)
+            element.find(coordinatesTag).text = '\n'.join([x.rewriteStr() for x in piece])
+            position += 1
+            parent.insert(position, element)
+            if isinstance(self.coordinates, CoordinateArray):
+                piece = CoordinateArray.pack(piece)
+            ret.append(LineString(element, self.tag, piece))
+        self.pieces = []
+        return ret
 
 class Polygon(GeometricObject):
     """
@@ -251,24 +597,44 @@ class Polygon(GeometricObject):
     is still an iceberg.
     """
 
-    def __init__(self, element, tag, coordinates):
-        super(Polygon, self).__init__(element, tag, coordinates)
+    def __init__(self, element, tag, coordinates, compact=0):
+        super(Polygon, self).__init__(element, tag, coordinates, compact)
 
     def applyEdits(self):
-        super(Polygon,self).applyEdits()
+        return super(Polygon,self).applyEdits()
 
 
 class GeometricFactory(object):
 
-    def __init__(self):
+    def __init__(self, namespace=None, compact=0):
         """
         `Author`: Bill Clark
 
         Factory object to produce geometric objects. Can be extended to do input checking and other
         such utility functions.
+
+        `namespace`: The namespace of the kml being read, None if it has none. Tags are matched in that namespace,
+                     the geometrics themselves are always tagged with the bare name.
+
+        `compact`: flag to build geometrics on the CoordinateArray backend.
         """
         self.geometryTypes = ('Point', 'LineString', 'LinearRing', 'Polygon', 'MultiGeometry')
-        pass
+        self.namespace = namespace
+        self.compact = compact
+        self.qualifiedTypes = dict((qualify(tag, namespace), tag) for tag in self.geometryTypes)
+        self.coordinatesTag = qualify('coordinates', namespace)
+
+    def localName(self, tag):
+        """
+        `Author`: Bill Clark
+
+        Returns the bare name of a geometry tag read in this factory's namespace.
+
+        `tag`: The tag of an lxml element.
+
+        `return`: The geometry type, Polygon, Point etc. None if the tag isn't a geometry.
+        """
+        return self.qualifiedTypes.get(tag)
 
     def createLiteral(self, element, tag, coordinates):
         """
@@ -286,11 +652,11 @@ class GeometricFactory(object):
         """
 
         if tag == 'Point':
-            return Point(element, tag, coordinates)
+            return Point(element, tag, coordinates, self.compact)
         elif tag == 'LinearRing':
-            return LinearRing(element, tag, coordinates)
+            return LinearRing(element, tag, coordinates, self.compact)
         elif tag == 'LineString':
-            return LineString(element, tag, coordinates)
+            return LineString(element, tag, coordinates, self.compact)
         else:
             print 'Bad tag.'
 
@@ -311,15 +677,16 @@ class GeometricFactory(object):
         """
 
 
-        if element.tag == "Polygon" :
+        tag = self.localName(element.tag)
+        if tag == "Polygon" :
             for x in element.iter():
-                if x.tag in self.geometryTypes and x.tag != "Polygon":
+                if x.tag in self.qualifiedTypes and self.localName(x.tag) != "Polygon":
                     for child in range(len(x)):
-                        if x[child].tag == "coordinates":
+                        if x[child].tag == self.coordinatesTag:
                             break
-                    return Polygon(x, element.tag, x[child].text)
+                    return Polygon(x, tag, x[child].text, self.compact)
 
-        elif element.tag == 'MultiGeometry':
+        elif tag == 'MultiGeometry':
             ret = []
             skip = 0
             first = 1  # Set to 1 initally to skip the actual multigeo tag.
@@ -331,14 +698,14 @@ class GeometricFactory(object):
                 if skip:
                     skip += len(x)
                     skip -= 1
-                elif x.tag in self.geometryTypes:
+                elif x.tag in self.qualifiedTypes:
                     geo = self.create(x)
                     assert geo is not None #Checking an object actually got made.
 
                     if type(geo) is list: ret.extend(geo) #catches multigeometry returns.
                     else: ret.append(geo)
 
-                    if x.tag == "Polygon" or x.tag == "MultiGeometry": skip += len(x)
+                    if self.localName(x.tag) in ("Polygon", "MultiGeometry"): skip += len(x)
                 else:
                     pass
 
@@ -346,14 +713,14 @@ class GeometricFactory(object):
 
         else:
             for child in range(len(element)):
-                if element[child].tag == "coordinates":
+                if element[child].tag == self.coordinatesTag:
                     break
-            if element.tag == 'Point':
-                return Point(element, element.tag, element[child].text)
-            elif element.tag == 'LinearRing':
-                return LinearRing(element, element.tag, element[child].text)
-            elif element.tag == 'LineString':
-                return LineString(element, element.tag, element[child].text)
+            if tag == 'Point':
+                return Point(element, tag, element[child].text, self.compact)
+            elif tag == 'LinearRing':
+                return LinearRing(element, tag, element[child].text, self.compact)
+            elif tag == 'LineString':
+                return LineString(element, tag, element[child].text, self.compact)
             else:
                 print 'derpy'
 
@@ -375,3 +742,38 @@ def elementPrint(element, bool=0):
         return etree.tostring(element, pretty_print=False)
     else:
         return etree.tostring(element, pretty_print=True)
+
+
+def qualify(tag, namespace=None):
+    """
+    `Author`: Bill Clark
+
+    Puts a tag in the namespace lxml reads it in, {namespace}tag. Lets a document be searched without having its
+    namespace stripped first.
+
+    `tag`: The bare tag name.
+
+    `namespace`: The namespace uri, or None for a document without one.
+
+    `return`: The qualified tag, or the bare tag when there is no namespace.
+    """
+
+    if namespace:
+        return '{' + namespace + '}' + tag
+    return tag
+
+
+def copyPoints(points):
+    """
+    `Author`: Bill Clark
+
+    Copies a sequence of coordinates down to the points, so nothing done to the copy reaches the original. Helper
+    function to GeometricObject.copy.
+
+    `points`: A list of LatLongPoints or a CoordinateArray.
+
+    `return`: The copy, of the same type. A CoordinateArray's slice is already a copy of its values.
+    """
+    if isinstance(points, CoordinateArray):
+        return points[:]
+    return [point.copy() for point in points]
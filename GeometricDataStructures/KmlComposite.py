@@ -0,0 +1,138 @@
+import os
+from multiprocessing import Pool
+from GeometricDataStructures.KmlFasade import KmlFasade
+
+
+class KmlComposite:
+
+    def __init__(self, *fasades):
+        """
+        `Author`: Bill Clark
+
+        This class wraps kml fasades. It's functions through the composite method. Any call made to a
+        KmlComposite calls the associated method on the fasades it wraps. No other actions are taken.
+        One method is missing from KmlFasade, adding geometry. It's rarely used, and more importantly
+        doesn't work with the concept of apply the same action to all members. Each methods details
+        can be obtained from the KmlFasade class. The whole run over every file can also be made in parallel,
+        see processAll.
+
+        `fasades`: A list of Kml Fasades.
+        """
+        self.fasades = fasades
+
+    def rewrite(self, path=None):
+        for fasade in self.fasades:
+            fasade.rewrite(self.outputPath(fasade, path))
+
+    def removeGarbageTags(self):
+        for fasade in self.fasades:
+            fasade.removeGarbageTags()
+
+    def pullPlacemarksAndGarbage(self):
+        for fasade in self.fasades:
+            fasade.pullPlacemarksAndGarbage()
+
+    def processPlacemarks(self, extract=0, geo=1):
+        for fasade in self.fasades:
+            fasade.processPlacemarks(extract, geo)
+
+    def fasadeUpdate(self):
+        for fasade in self.fasades:
+            fasade.fasadeUpdate()
+
+    def createAdditionsFolder(self):
+        for fasade in self.fasades:
+            fasade.createAdditionsFolder()
+
+    def buildIndex(self):
+        for fasade in self.fasades:
+            fasade.buildIndex()
+
+    def yieldIndexes(self):
+        for fasade in self.fasades:
+            yield fasade.index
+
+    def yieldGeometrics(self):
+        for fasade in self.fasades:
+            yield fasade.geometrics
+
+    def outputPath(self, fasade, path=None):
+        """
+        `Author`: Bill Clark
+
+        Where a member file is rewritten to. Several files can't share one path, so a given path is a folder
+        that each file is written into under its own name.
+
+        `fasade`: The member fasade.
+
+        `path`: The folder to write into, made if it doesn't exist. None to write over the source file.
+
+        `return`: The path to write the fasade to.
+        """
+        if path is None:
+            return fasade.filepath
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return os.path.join(path, os.path.basename(fasade.filepath))
+
+    def processAll(self, restriction=None, extract=0, path=0, index=0, processes=None):
+        """
+        `Author`: Bill Clark
+
+        Runs every member file through the whole of a console run in parallel, one file to a worker process.
+        Each worker parses its file, makes the geometrics, extracts the metadata, restricts and rewrites it, and
+        sends back its geometrics without their xml elements. The geometrics are kept on the member fasades, so
+        yieldGeometrics and yieldIndexes hand them to the UrlBuilder as before. The members only need their file
+        paths, they can be made with the stream flag so the parent never parses them.
+
+        `restriction`: The restriction to run on every file. None for no restriction.
+
+        `extract`: flag to extract the metadata, see KmlFasade.processPlacemarks.
+
+        `path`: The folder to rewrite the files into, see outputPath. 0 to leave the files unwritten.
+
+        `index`: flag to restrict through a spatial index, and to leave one on each fasade.
+
+        `processes`: The number of worker processes. None for one per core, 1 to run in this process.
+        """
+        tasks = [(fasade.filepath, fasade.compact, restriction, extract, index,
+                  self.outputPath(fasade, path) if path else None) for fasade in self.fasades]
+        if processes == 1 or len(tasks) < 2:
+            results = map(processFile, tasks)
+        else:
+            pool = Pool(processes)
+            try:
+                results = pool.map(processFile, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        for fasade, geometrics in zip(self.fasades, results):
+            fasade.geometrics = geometrics
+            if index:
+                fasade.buildIndex()
+
+
+def processFile(task):
+    """
+    `Author`: Bill Clark
+
+    Runs one member file of a composite through a console run. At module level so the pool can find it. Helper
+    function to KmlComposite.processAll.
+
+    `task`: A tuple of the file path, the compact flag, the restriction, the extract flag, the index flag, and the
+            path to rewrite to or None.
+
+    `return`: The geometrics left in the file, copied without their xml elements so they can be sent back.
+    """
+    filepath, compact, restriction, extract, index, output = task
+    fasade = KmlFasade(filepath, compact=compact)
+    fasade.processPlacemarks(extract)
+    if index: fasade.buildIndex()
+    if output: fasade.removeGarbageTags()
+    if restriction is not None:
+        for geometrics in (fasade.yieldIndexes() if index else fasade.yieldGeometrics()):
+            restriction.restrict(geometrics)
+        fasade.fasadeUpdate()
+    if output: fasade.rewrite(output)
+    return [x.copy(None) for x in fasade.geometrics]
@@ -1,15 +1,19 @@
 from lxml import etree, objectify
 from GeometricDataStructures.Geometrics import *
+from GeometricDataStructures.SpatialIndex import GeometricIndex
 from pykml.factory import KML_ElementMaker as KML
-import re
 import os
+import copy
 
 debug = 0
+garbageData = ["styleUrl", 'Style', 'LookAt', 'visibility', 'Snippet',
+               'ScreenOverlay', 'tessellate', 'altitudeMode', 'extrude', 'TimeSpan']
+containerData = ('kml', 'Document', 'Folder')
 
 
 class KmlFasade(object):
 
-    def __init__(self, path):
+    def __init__(self, path, stream=0, compact=0):
         """
         `Author`: Bill Clark
 
@@ -17,33 +21,70 @@ class KmlFasade(object):
         functionality that ignores irrelevant carry over data. It provides function to return list of useful
         xml data, tools to apply changes to the xml file based on the objects it generates, and other features.
 
+        The file is parsed once, straight from disk, and is never written back to. Namespaced documents are
+        searched with tags qualified in the document's namespace rather than having the namespace stripped.
+
         `path`: Path of the source file.
+
+        `stream`: flag to skip parsing the whole file into memory. A streamed fasade is only used through
+                  streamPlacemarks, which reads the file one placemark at a time.
+
+        `compact`: flag to store geometric coordinates in CoordinateArrays instead of LatLongPoint lists.
         """
 
         self.filepath = path
         self.placemarks = None
         self.garbage = []
         self.geometrics = None
+        self.index = None
         self.additionfolder = None
+        self.compact = compact
+        self.setNamespace(None)
 
-        #Before we open the file as a kml object, we need to open it
-        # as a regular file and remove the namspace on the file. Otherwise searching will fail.
-        file = open(path, 'r')
-        lines = file.readlines()
-        file.close()
+        if stream:  # The namespace is read off the root once streaming starts.
+            self.kmlTree = None
+            self.kmlRoot = None
+        else:
+            self.kmlTree = etree.parse(path)
+            self.kmlRoot = self.kmlTree.getroot()
+            self.setNamespace(etree.QName(self.kmlRoot).namespace)
 
-        for i in xrange(len(lines)):
-            if re.search("<kml xmlns=.*", lines[i]) is not None: #Found the namespace line, remove it and rewrite.
-                lines[i] = "<kml>\n"
-                file = open(path, 'w')
-                file.writelines(lines)
-                file.close()
-                break
-            elif re.search("<kml>[\s]*", lines[1]) is not None: #A no namespace line was found, break out of the loop.
-                break
+    def copy(self):
+        """
+        `Author`: Bill Clark
 
-        self.kmlTree = etree.parse(path)
-        self.kmlRoot = self.kmlTree.getroot()
+        Makes an independent copy of a parsed fasade, without going back to the file. The tree is copied, and the
+        geometrics are copied onto the matching elements of the new tree, so a restriction, fasadeUpdate and
+        rewrite on the copy leave this fasade as it was. One parse can serve any number of viewports this way.
+
+        `return`: The new KmlFasade.
+        """
+        ret = copy.copy(self)
+        ret.kmlTree = copy.deepcopy(self.kmlTree)
+        ret.kmlRoot = ret.kmlTree.getroot()
+        elements = dict(zip(self.kmlRoot.iter(), ret.kmlRoot.iter()))  # A copied tree iterates in the same order.
+        ret.garbage = [elements[x] for x in self.garbage if x in elements]
+        if self.geometrics is not None:
+            ret.geometrics = [x.copy(elements[x.element]) for x in self.geometrics]
+        if self.index is not None:
+            ret.buildIndex()
+        if self.additionfolder is not None:
+            ret.additionfolder = copy.deepcopy(self.additionfolder)
+        return ret
+
+    def setNamespace(self, namespace):
+        """
+        `Author`: Bill Clark
+
+        Stores the namespace of the document and resolves every tag this class searches for into it, once, so that
+        the searches are plain comparisons against lxml's {namespace}tag names.
+
+        `namespace`: The namespace uri of the kml root, None if the document has none.
+        """
+        self.namespace = namespace
+        self.tags = dict((tag, qualify(tag, namespace)) for tag in ('Placemark', 'Document', 'name', 'description'))
+        self.garbageTags = set(qualify(tag, namespace) for tag in garbageData)
+        self.containerTags = set(qualify(tag, namespace) for tag in containerData)
 
 
     def rewrite(self, path=None):
@@ -66,6 +107,27 @@ class KmlFasade(object):
             self.kmlTree.write(f, pretty_print=True)
             f.close()
 
+    def writeResult(self, result, path):
+        """
+        `Author`: Bill Clark
+
+        Writes a restriction's result out as kml, leaving this fasade untouched. The edits are applied to a copy,
+        where each geometric takes its pieces from the result and those the result dropped are removed.
+
+        `result`: A RestrictionResult from clipping this fasade's geometrics, or an index over them.
+
+        `path`: The path to write to.
+        """
+        view = self.copy()
+        for source, geometry in zip(self.geometrics, view.geometrics):
+            pieces = result.piecesOf(source)
+            if pieces is None:
+                geometry.remove = len(geometry.coordinates)
+            else:
+                geometry.setPieces(pieces)
+        view.fasadeUpdate()
+        view.rewrite(path)
+
     def removeGarbageTags(self):
         """
         `Author`: Bill Clark
@@ -94,14 +156,13 @@ class KmlFasade(object):
         `return`: A list of lxml Element objects matching the placemark tag. This is also stored in class.
         """
 
-        garbageData = ["styleUrl", 'Style', 'LookAt', 'visibility', 'Snippet',
-                       'ScreenOverlay', 'tessellate', 'altitudeMode', 'extrude', 'TimeSpan']
         ret = []
+        placemarkTag = self.tags['Placemark']
         for x in self.kmlRoot.iter():
-            if x.tag == 'Placemark':
+            if x.tag == placemarkTag:
                 if debug: print x.tag, x.text
                 ret.append(x)
-            elif x.tag in garbageData:
+            elif x.tag in self.garbageTags:
                 self.garbage.append(x)
         # self.placemarks = ret
         return ret
@@ -127,47 +188,182 @@ class KmlFasade(object):
         if(self.placemarks is None):
             placemarks = self.pullPlacemarksAndGarbage()
 
-        factory = GeometricFactory()
+        factory = GeometricFactory(self.namespace, self.compact)
         ret = []
-        skip = 0
 
-        if extract:
-            directory = "Outputs\Metadata\\" + os.path.basename(self.filepath)[:-3]
-            if not os.path.exists(directory):
-                os.mkdir(directory)
+        directory = self.metadataDirectory() if extract else None
 
         for place in placemarks:
-            for element in place.iter():
-
-                if extract:
-                    if element.tag == "name":
-                        filename = element.text
-                        output = open(directory + "\\" + filename, 'a')
-                        output.write(self.html_entry("h1", element.tag, element.text))
-                        output.close()
-                    elif element.tag == "description":
-                        output = open(directory + "\\" + filename, 'a')
-                        output.write(self.html_entry("h2", element.tag, element.text))
-                        output.close()
-
-                if geos:
-                    if skip:
-                        skip += len(element)
-                        skip-=1
-
-                    elif element.tag in factory.geometryTypes:
-                        geo = factory.create(element)
-                        assert geo is not None  # Checking an object actually got made.
-
-                        if type(geo) is list: ret.extend(geo)  # catches multigeometry returns.
-                        else: ret.append(geo)
-
-                        if element.tag == "Polygon" or element.tag == "MultiGeometry": skip = len(element)
-                    else:
-                        pass
+            ret.extend(self.processPlacemark(place, factory, extract, geos, directory))
         self.geometrics = ret
         return ret
 
+    def processPlacemark(self, place, factory, extract=0, geos=1, directory=None):
+        """
+        `Author`: Bill Clark, Nick LaPosta
+
+        The body of processPlacemarks, run on a single placemark. Split out so that the streaming mode can convert
+        placemarks as they are read instead of after the whole file is in memory.
+
+        `place`: The placemark element to process.
+
+        `factory`: The GeometricFactory used to build the geometrics, in this document's namespace.
+
+        `extract`: flag to turn on the HTML metadata extraction. Defaults to off.
+
+        `geos`: flag to turn on the geometric conversion. Defaults to on.
+
+        `directory`: The metadata folder extracted data is written to. Required when extract is set.
+
+        `return`: List of geometric objects found in the placemark.
+        """
+
+        ret = []
+        skip = 0
+        filename = None
+        for element in place.iter():
+
+            if extract:
+                if element.tag == self.tags['name']:
+                    filename = element.text
+                    output = open(directory + "\\" + filename, 'a')
+                    output.write(self.html_entry("h1", "name", element.text))
+                    output.close()
+                elif element.tag == self.tags['description'] and filename is not None:
+                    output = open(directory + "\\" + filename, 'a')
+                    output.write(self.html_entry("h2", "description", element.text))
+                    output.close()
+
+            if geos:
+                if skip:
+                    skip += len(element)
+                    skip-=1
+
+                elif element.tag in factory.qualifiedTypes:
+                    geo = factory.create(element)
+                    assert geo is not None  # Checking an object actually got made.
+
+                    if type(geo) is list: ret.extend(geo)  # catches multigeometry returns.
+                    else: ret.append(geo)
+
+                    if factory.localName(element.tag) in ("Polygon", "MultiGeometry"): skip = len(element)
+                else:
+                    pass
+        return ret
+
+    def metadataDirectory(self):
+        """
+        `Author`: Nick LaPosta
+
+        Makes sure the Outputs\metadata folder for this file exists.
+
+        `return`: The path of the folder.
+        """
+        directory = "Outputs\Metadata\\" + os.path.basename(self.filepath)[:-3]
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        return directory
+
+    def streamPlacemarks(self, path, restriction=None, extract=0, keep=0):
+        """
+        `Author`: Bill Clark
+
+        The streaming version of processPlacemarks, fasadeUpdate and rewrite, for files too large to hold in memory.
+        The source is read with iterparse, one top level element at a time. Each placemark is turned into
+        geometrics, restricted, has its edits and garbage removal applied, and is written to the output before being
+        cleared. Documents and folders are written around them as they open and close, everything else is copied
+        across as is. Peak memory is one placemark, no matter the size of the file.
+
+        `path`: The path to write the restricted kml to.
+
+        `restriction`: A restriction to run on each placemark's geometrics. Optional.
+
+        `extract`: flag to turn on the HTML metadata extraction. Defaults to off.
+
+        `keep`: flag to store the surviving geometrics in this object, for the url builder. Only worth setting when a
+                restriction is cutting the file down, otherwise the whole file ends up in memory again.
+
+        `return`: The number of placemarks read, including any the restriction emptied.
+        """
+
+        factory = None
+        directory = self.metadataDirectory() if extract else None
+        self.geometrics = []
+        count = 0
+        depth = 0  # How far inside a non container element the parser is.
+        opened = []
+
+        output = open(path, 'w')
+        with etree.xmlfile(output, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            for event, element in etree.iterparse(self.filepath, events=('start', 'end'), remove_blank_text=True):
+                if event == 'start':
+                    if factory is None:  # The root, everything is searched in its namespace.
+                        self.setNamespace(etree.QName(element).namespace)
+                        factory = GeometricFactory(self.namespace, self.compact)
+                    if depth == 0 and element.tag in self.containerTags:
+                        inherited = element.getparent().nsmap if element.getparent() is not None else {}
+                        nsmap = dict((k, v) for k, v in element.nsmap.items() if inherited.get(k) != v)
+                        opened.append(xf.element(element.tag, dict(element.attrib), nsmap=nsmap))
+                        opened[-1].__enter__()
+                        xf.write('\n')
+                    else:
+                        depth += 1
+                    continue
+
+                if depth == 0:  # A container closed.
+                    opened.pop().__exit__(None, None, None)
+                    if opened: xf.write('\n')
+                else:
+                    depth -= 1
+                    if depth:  # Still inside a top level element, it's handled when that one closes.
+                        continue
+                    if element.tag == self.tags['Placemark']:
+                        geometrics = self.processPlacemark(element, factory, extract, 1, directory)
+                        if restriction is not None:
+                            restriction.restrict(geometrics)
+                        for geometric in list(geometrics):
+                            geometrics.extend(geometric.applyEdits())
+                        if keep:
+                            self.geometrics.extend([e for e in geometrics if not e.remove == len(e.coordinates)])
+                        count += 1
+                    if element.tag not in self.garbageTags:
+                        for garbage in [x for x in element.iter() if x.tag in self.garbageTags]:
+                            garbage.getparent().remove(garbage)
+                        parent = element.getparent()
+                        xf.flush()
+                        output.write(self.serialize(element, parent.nsmap if parent is not None else {}))
+
+                # Free everything read so far, the parser keeps the tree otherwise.
+                element.clear()
+                parent = element.getparent()
+                while parent is not None and element.getprevious() is not None:
+                    del parent[0]
+        output.close()
+        return count
+
+    def serialize(self, element, inherited):
+        """
+        `Author`: Bill Clark
+
+        Writes out a top level element for streamPlacemarks. lxml declares every namespace in scope on the root of
+        anything it serializes, so the element is serialized detached, with the namespaces it doesn't use cleaned
+        away, and then its root loses the declarations the containers already written around it made.
+
+        `element`: The element to write.
+
+        `inherited`: The namespaces in scope where it's written, a dict of prefix to uri.
+
+        `return`: The element as UTF-8 text.
+        """
+        written = copy.deepcopy(element)
+        etree.cleanup_namespaces(written)
+        text = etree.tostring(written, encoding='UTF-8', xml_declaration=False, pretty_print=True)
+        head, rest = text.split('>', 1)  # The root's start tag, a '>' in an attribute is written as &gt;.
+        for prefix, uri in inherited.items():
+            head = head.replace(' xmlns{}="{}"'.format(':' + prefix if prefix else '', uri), '', 1)
+        return head + '>' + rest
+
     def html_entry(self, html_tag, tag, text):
         """
         `Author`: Nick Laposta
@@ -190,15 +386,23 @@ class KmlFasade(object):
 
         Runs the applyedit function on every geometric object contained in this objects geometric's list.
         If the addition folder has been generated, This method will also add that folder to the file.
+        Geometrics that the edits split into pieces add the new pieces to the list, and the spatial index, if one
+        was built, is rebuilt to hold them. A restriction run on the index first has the geometrics it narrowed
+        away flagged for removal, see GeometricIndex.release.
         """
 
+        if self.index is not None:
+            self.index.release()
+        added = []
         for element in self.geometrics:
-            element.applyEdits()
-        self.geometrics = [e for e in self.geometrics if not e.remove == len(e.coordinates)]
+            added.extend(element.applyEdits())
+        self.geometrics = [e for e in self.geometrics if not e.remove == len(e.coordinates)] + added
+        if added and self.index is not None:
+            self.buildIndex()
 
         if self.additionfolder is not None:
             for x in self.kmlRoot.iter():
-                if x.tag == "Document":
+                if x.tag == self.tags['Document']:
                     x.append(self.additionfolder)
                     break
 
@@ -243,6 +447,27 @@ class KmlFasade(object):
 
         self.additionfolder.append(pm1)
 
+    def buildIndex(self):
+        """
+        `Author`: Bill Clark
+
+        Builds a spatial index over the geometrics from processPlacemarks, so restrictions and the url builder can
+        ask for just the geometrics in a viewport. Build it once and reuse it across viewports.
+
+        `return`: The GeometricIndex. This is stored in class as well.
+        """
+        self.index = GeometricIndex(self.geometrics)
+        return self.index
+
+    def yieldIndexes(self):
+        """
+        `Author`: Bill Clark
+
+        The index counterpart of yieldGeometrics. Yields the index built by buildIndex, so restrictions and the url
+        builder can be handed it in place of the geometric list.
+        """
+        yield self.index
+
     def yieldGeometrics(self):
         """
         `Author`: Bill Clark
@@ -2,17 +2,43 @@ from __future__ import division
 import math
 from GeometricDataStructures.Geometrics import LatLongPoint
 
+try:
+    import numpy
+except ImportError:  # The batch projections fall back to plain loops.
+    numpy = None
 
-class MercatorPoint:
+
+class MercatorPoint(object):
     """
     `Author`: Nick LaPosta
 
-    Container for the location of a pixel on a Mercator map projection
+    Container for the location of a pixel on a Mercator map projection. A slotted value type, points with the same
+    x and y are equal and hash the same.
     """
+    __slots__ = ('x', 'y')
+
     def __init__(self, x=0, y=0):
         self.x = x
         self.y = y
 
+    def __eq__(self, other):
+        return isinstance(other, MercatorPoint) and self.x == other.x and self.y == other.y
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def __getstate__(self):
+        return (self.x, self.y)
+
+    def __setstate__(self, state):
+        self.x, self.y = state
+
+    def __repr__(self):
+        return 'MercatorPoint(' + repr(self.x) + ', ' + repr(self.y) + ')'
+
 
 class MercatorProjection:
     """
@@ -72,6 +98,100 @@ class MercatorProjection:
         lat = self.radians_to_degrees(2 * math.atan(math.exp(lat_radians)) - math.pi / 2)
         return LatLongPoint(lat, lng)
 
+    def from_lat_lng_arrays_to_points(self, lats, lngs, zoom=0):
+        """
+        `Author`: Nick LaPosta, Bill Clark
+
+        The batch version of from_lat_lng_to_point. Projects a whole run of coordinates in one call, with NumPy when
+        it is installed and a single tight loop when it isn't.
+
+        `lats`:  A sequence of latitudes.
+
+        `lngs`:  A sequence of longitudes, the same length as lats.
+
+        `zoom`:  The zoom level to scale the pixels to. 0 gives the same pixels as from_lat_lng_to_point.
+
+        `return`:  A tuple of the x and y pixel coordinates, NumPy arrays or lists when NumPy is missing.
+        """
+        scale = 2 ** zoom
+        origin_x = self.pixelOrigin_.x
+        origin_y = self.pixelOrigin_.y
+        per_degree = self.pixelsPerLonDegree_
+        per_radian = self.pixelsPerLonRadian_
+
+        if numpy is not None:
+            lats = numpy.asarray(lats, dtype=float)
+            lngs = numpy.asarray(lngs, dtype=float)
+            sin_y = numpy.clip(numpy.sin(lats * (math.pi / 180)), -0.9999, 0.9999)
+            xs = (origin_x + lngs * per_degree) * scale
+            ys = (origin_y + 0.5 * numpy.log((1 + sin_y) / (1 - sin_y)) * -per_radian) * scale
+            return xs, ys
+
+        sin, log = math.sin, math.log
+        to_radians = math.pi / 180
+        xs = [(origin_x + lng * per_degree) * scale for lng in lngs]
+        ys = []
+        for lat in lats:
+            sin_y = min(max(sin(lat * to_radians), -0.9999), 0.9999)
+            ys.append((origin_y + 0.5 * log((1 + sin_y) / (1 - sin_y)) * -per_radian) * scale)
+        return xs, ys
+
+    def from_points_to_lat_lng_arrays(self, xs, ys, zoom=0):
+        """
+        `Author`: Nick LaPosta, Bill Clark
+
+        The batch version of from_point_to_lat_lng, the inverse of from_lat_lng_arrays_to_points.
+
+        `xs`:  A sequence of x pixel coordinates.
+
+        `ys`:  A sequence of y pixel coordinates, the same length as xs.
+
+        `zoom`:  The zoom level the pixels are scaled to.
+
+        `return`:  A tuple of the latitudes and longitudes, NumPy arrays or lists when NumPy is missing.
+        """
+        scale = 2 ** zoom
+        origin_x = self.pixelOrigin_.x
+        origin_y = self.pixelOrigin_.y
+        per_degree = self.pixelsPerLonDegree_
+        per_radian = self.pixelsPerLonRadian_
+
+        if numpy is not None:
+            xs = numpy.asarray(xs, dtype=float) / scale
+            ys = numpy.asarray(ys, dtype=float) / scale
+            lngs = (xs - origin_x) / per_degree
+            lats = numpy.degrees(2 * numpy.arctan(numpy.exp((ys - origin_y) / -per_radian)) - math.pi / 2)
+            return lats, lngs
+
+        atan, exp = math.atan, math.exp
+        to_degrees = 180 / math.pi
+        lngs = [(x / scale - origin_x) / per_degree for x in xs]
+        lats = [(2 * atan(exp((y / scale - origin_y) / -per_radian)) - math.pi / 2) * to_degrees for y in ys]
+        return lats, lngs
+
+    def project_geometrics(self, geometrics, zoom):
+        """
+        `Author`: Bill Clark
+
+        Projects every coordinate of every geometric given in a single batch call, and stores each geometric's share
+        in its pixel cache for the zoom. Geometrics already cached for the zoom are skipped.
+
+        `geometrics`:  A list of geometric objects.
+
+        `zoom`:  The zoom level to project to.
+        """
+        pending = [geometric for geometric in geometrics if zoom not in geometric.pixels]
+        lats, lngs, offsets = [], [], [0]
+        for geometric in pending:
+            geometric_lats, geometric_lngs = geometric.latLngArrays()
+            lats.extend(geometric_lats)
+            lngs.extend(geometric_lngs)
+            offsets.append(len(lats))
+
+        xs, ys = self.from_lat_lng_arrays_to_points(lats, lngs, zoom)
+        for i, geometric in enumerate(pending):
+            geometric.pixels[zoom] = (xs[offsets[i]:offsets[i + 1]], ys[offsets[i]:offsets[i + 1]])
+
     def bound(self, value, opt_min, opt_max):
         if opt_min is not None:
             value = max(value, opt_min)
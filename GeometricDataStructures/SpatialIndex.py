@@ -0,0 +1,168 @@
+from math import ceil, sqrt
+
+
+class GeometricIndex(object):
+
+    def __init__(self, geometrics, nodeSize=16):
+        """
+        `Author`: Bill Clark
+
+        A spatial index over a list of geometrics, an R-tree bulk loaded with Sort-Tile-Recursive packing. It is
+        built once from the cached bounding boxes of the geometrics and answers which of them intersect a
+        rectangle in sub-linear time, so that many viewports can be run over one file without scanning every
+        geometric for each.
+
+        `geometrics`: A list of geometric objects, as made by KmlFasade.processPlacemarks.
+
+        `nodeSize`: The most children a node of the tree holds.
+        """
+        self.geometrics = list(geometrics)
+        self.nodeSize = nodeSize
+        self.narrowed = None  # Positions of the geometrics still in play after narrow, None when all of them are.
+
+        # Leaf entries are (bounds, position in self.geometrics), nodes are (bounds, list of children).
+        entries = [(geometric.bounds, i) for i, geometric in enumerate(self.geometrics)
+                   if geometric.bounds is not None]
+        self.depth = 0
+        while len(entries) > nodeSize:
+            entries = self.pack(entries)
+            self.depth += 1
+        self.root = (self.union(entries), entries) if entries else None
+
+    def pack(self, entries):
+        """
+        `Author`: Bill Clark
+
+        One level of Sort-Tile-Recursive packing. The entries are sorted by the x of their centers and cut into
+        vertical slices, each slice is sorted by the y of the centers and cut into nodes of nodeSize.
+
+        `entries`: The entries of the level below, tuples of bounds and a child.
+
+        `return`: The nodes of the new level, tuples of bounds and their list of children.
+        """
+        nodeCount = int(ceil(len(entries) / float(self.nodeSize)))
+        sliceCount = int(ceil(sqrt(nodeCount)))
+        sliceSize = sliceCount * self.nodeSize
+
+        entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])
+        ret = []
+        for start in xrange(0, len(entries), sliceSize):
+            column = sorted(entries[start:start + sliceSize], key=lambda entry: entry[0][1] + entry[0][3])
+            for first in xrange(0, len(column), self.nodeSize):
+                children = column[first:first + self.nodeSize]
+                ret.append((self.union(children), children))
+        return ret
+
+    def union(self, entries):
+        """
+        `Author`: Bill Clark
+
+        `entries`: A list of tuples whose first value is a west, south, east, north bounds.
+
+        `return`: The bounds covering every entry.
+        """
+        return (min(entry[0][0] for entry in entries), min(entry[0][1] for entry in entries),
+                max(entry[0][2] for entry in entries), max(entry[0][3] for entry in entries))
+
+    def query(self, bounds):
+        """
+        `Author`: Bill Clark
+
+        Finds the geometrics whose bounding box intersects the given rectangle. The tree holds the boxes the
+        geometrics had when it was built; clipping only ever shrinks a geometry, so each hit is checked again
+        against its current box, and geometrics flagged for total removal, or left out by narrow, are left out.
+
+        `bounds`: The rectangle to search, a tuple of west, south, east, north.
+
+        `return`: The intersecting geometrics, in the order they were given to the index.
+        """
+        return [self.geometrics[i] for i in self.search(bounds)]
+
+    def narrow(self, bounds):
+        """
+        `Author`: Bill Clark
+
+        Queries the index and keeps only the hits in play. Geometrics outside the rectangle are left as they are
+        rather than flagged for removal, so a viewport restriction costs the size of its query, not of the file.
+        Later queries and iteration only see what's in play, and release flags the rest for removal.
+
+        `bounds`: The rectangle to search, a tuple of west, south, east, north.
+
+        `return`: The intersecting geometrics, as query.
+        """
+        positions = self.search(bounds)
+        self.narrowed = set(positions)
+        return [self.geometrics[i] for i in positions]
+
+    def release(self):
+        """
+        `Author`: Bill Clark
+
+        Flags every geometric the narrowing left out for removal and puts them all back in play. Visits every
+        geometric, so it's left to KmlFasade.fasadeUpdate, which applies the edits of every geometric anyway.
+        """
+        if self.narrowed is None:
+            return
+        for i, geometric in enumerate(self.geometrics):
+            if i not in self.narrowed:
+                geometric.remove = len(geometric.coordinates)
+        self.narrowed = None
+
+    def search(self, bounds):
+        """
+        `Author`: Bill Clark
+
+        The tree search behind query and narrow.
+
+        `bounds`: The rectangle to search, a tuple of west, south, east, north.
+
+        `return`: The sorted positions in self.geometrics of the intersecting geometrics.
+        """
+        if self.root is None:
+            return []
+        west, south, east, north = bounds
+        found = []
+        stack = [(self.root, self.depth)]
+        while stack:
+            (box, children), level = stack.pop()
+            if box[2] < west or box[0] > east or box[3] < south or box[1] > north:
+                continue
+            if level == 0:
+                found.extend(child for child in children if not (child[0][2] < west or child[0][0] > east or
+                                                                 child[0][3] < south or child[0][1] > north))
+            else:
+                stack.extend((child, level - 1) for child in children)
+
+        ret = []
+        for entry in sorted(found, key=lambda entry: entry[1]):
+            if self.narrowed is not None and entry[1] not in self.narrowed:
+                continue
+            geometric = self.geometrics[entry[1]]
+            current = geometric.bounds
+            if current is None or geometric.remove == len(geometric.coordinates):
+                continue
+            if current[2] < west or current[0] > east or current[3] < south or current[1] > north:
+                continue
+            ret.append(entry[1])
+        return ret
+
+    def __len__(self):
+        return len(self.geometrics)
+
+    def __iter__(self):
+        if self.narrowed is None:
+            return iter(self.geometrics)
+        return (self.geometrics[i] for i in sorted(self.narrowed))
+
+
+def viewportBounds(viewport):
+    """
+    `Author`: Bill Clark
+
+    Converts the corners returned by MercatorProjection.get_corners into a bounds tuple for the index.
+
+    `viewport`: The NE, NW, SW, SE corners of a viewport, as LatLongPoints.
+
+    `return`: A tuple of west, south, east, north.
+    """
+    return viewport[1].lng, viewport[3].lat, viewport[3].lng, viewport[1].lat
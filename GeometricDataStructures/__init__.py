@@ -2,5 +2,6 @@ import KmlFasade
 import Geometrics
 import Mercator
 import KmlComposite
+import SpatialIndex
 
-__all__ = ["KmlFasade", "Geometrics", "Mercator", "KmlComposite.py"]
+__all__ = ["KmlFasade", "Geometrics", "Mercator", "KmlComposite", "SpatialIndex"]
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from Observer import Observable
+
+try:
+    import resource
+except ImportError:  # Unix only, peak memory isn't reported on windows.
+    resource = None
+
+
+class Stage(object):
+
+    def __init__(self, name):
+        """
+        `Author`: Bill Clark
+
+        The measurements of one stage of a run. Filled in by Instrumentation.begin and end.
+
+        `name`: The name of the stage.
+        """
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = None
+        self.counts = {}
+
+    def export(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: The stage as a dict, for json.
+        """
+        return {'name': self.name, 'wall': self.wall, 'cpu': self.cpu, 'peakRss': self.peak, 'counts': self.counts}
+
+
+class Instrumentation(Observable):
+
+    def __init__(self):
+        """
+        `Author`: Bill Clark
+
+        Times the stages of a console run and counts what each one handled, so a slow run can be put down to the
+        stage that made it slow. Each stage records its wall time, its cpu time, counting the worker processes it
+        waited on, and the peak resident memory of the run by its end. A run is read back as a printed summary or
+        exported as json. Stages are run one at a time, begin starts one and end closes it.
+        """
+        super(Instrumentation, self).__init__()
+        self.stages = []
+        self.current = None
+        self.started = None
+
+    def begin(self, name):
+        """
+        `Author`: Bill Clark
+
+        Starts a stage, ending the one before it if it's still open.
+
+        `name`: The name of the stage.
+        """
+        if self.current is not None:
+            self.end()
+        self.current = Stage(name)
+        self.started = (time.time(), self.cpuTime())
+
+    def end(self, **counts):
+        """
+        `Author`: Bill Clark
+
+        Closes the open stage and records it.
+
+        `counts`: Any counts to add to the stage, by name.
+        """
+        if self.current is None:
+            return
+        wall, cpu = self.started
+        stage = self.current
+        stage.wall = time.time() - wall
+        stage.cpu = self.cpuTime() - cpu
+        stage.peak = self.peakMemory()
+        stage.counts.update(counts)
+        self.stages.append(stage)
+        self.current = None
+        self.setStatus('{} took {:.3f}s.'.format(stage.name, stage.wall))
+
+    def cpuTime(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: The seconds of cpu this process and the children it has waited on have used, user and system.
+        """
+        times = os.times()
+        return times[0] + times[1] + times[2] + times[3]
+
+    def peakMemory(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: The peak resident memory of this process, or of its largest child if that was higher, in
+                  kilobytes. None where the resource module is missing.
+        """
+        if resource is None:
+            return None
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        if os.uname()[0] == 'Darwin':  # Reported in bytes rather than kilobytes.
+            peak //= 1024
+        return peak
+
+    def summary(self):
+        """
+        `Author`: Bill Clark
+
+        `return`: The stages as a table, one line each, with a line of totals.
+        """
+        lines = ['{:<20}{:>10}{:>10}{:>12}  {}'.format('stage', 'wall s', 'cpu s', 'peak kb', 'counts')]
+        for stage in self.stages:
+            counts = ', '.join('{} {}'.format(name, stage.counts[name]) for name in sorted(stage.counts))
+            lines.append('{:<20}{:>10.3f}{:>10.3f}{:>12}  {}'.format(stage.name, stage.wall, stage.cpu,
+                                                                   stage.peak if stage.peak is not None else '-',
+                                                                   counts))
+        peaks = [stage.peak for stage in self.stages if stage.peak is not None]
+        lines.append('{:<20}{:>10.3f}{:>10.3f}{:>12}'.format('total', sum(stage.wall for stage in self.stages),
+                                                              sum(stage.cpu for stage in self.stages),
+                                                              max(peaks) if peaks else '-'))
+        return '\n'.join(lines)
+
+    def export(self, path=None):
+        """
+        `Author`: Bill Clark
+
+        Exports the stages as json.
+
+        `path`: The file to write the json to. None to only return it.
+
+        `return`: The json text.
+        """
+        text = json.dumps({'stages': [stage.export() for stage in self.stages],
+                           'wall': sum(stage.wall for stage in self.stages),
+                           'cpu': sum(stage.cpu for stage in self.stages)}, indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as output:
+                output.write(text)
+        return text
@@ -2,5 +2,6 @@ from ObservableConsole import ObservableConsole
 from Observer import *
 from UiObserver import UiObserver
 from WaitObserver import WaitObserver
+from Instrumentation import Instrumentation
 
-__all__ = ['ObservableConsole', 'Observer', 'Observable', 'WaitObserver', 'UiObserver']
\ No newline at end of file
+__all__ = ['ObservableConsole', 'Observer', 'Observable', 'WaitObserver', 'UiObserver', 'Instrumentation']
\ No newline at end of file
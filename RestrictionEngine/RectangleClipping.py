@@ -0,0 +1,139 @@
+from GeometricDataStructures.Geometrics import LatLongPoint
+
+
+class RectangleClipping(object):
+
+    def __init__(self, viewport):
+        """
+        `Author`: Bill Clark
+
+        Clips geometry against an axis aligned rectangle, the only shape a viewport from get_corners can be. With
+        the edges fixed to lines of constant lat or long, each test is a single comparison and each intersection a
+        single interpolation, so it avoids the general segment intersections, orientation tests and distance
+        sorting of the WeilerAtherton module. Rings are clipped with Sutherland Hodgman, lines with Liang Barsky.
+
+        `viewport`: The NE, NW, SW, SE corners returned by the get_corners method of the mercator module.
+        """
+        self.west = viewport[1].lng
+        self.north = viewport[1].lat
+        self.east = viewport[3].lng
+        self.south = viewport[3].lat
+
+    def clipRing(self, lats, lngs):
+        """
+        `Author`: Bill Clark
+
+        Sutherland Hodgman clipping of a closed ring. The ring is clipped against each edge of the rectangle in
+        turn, each pass linear in the vertices it gets. A concave ring that leaves and re-enters the rectangle stays
+        one ring, joined by runs along the rectangle's edge.
+
+        `lats`: The latitudes of the ring, in order.
+
+        `lngs`: The longitudes of the ring, in order.
+
+        `return`: The clipped ring as a closed list of LatLongPoints, empty if nothing is left.
+        """
+        points = zip(lngs, lats)
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        for axis, bound, lower in ((0, self.west, 1), (0, self.east, 0), (1, self.south, 1), (1, self.north, 0)):
+            points = self.clipEdge(points, axis, bound, lower)
+            if not points:
+                return []
+        ret = [LatLongPoint(y, x) for x, y in points]
+        ret.append(LatLongPoint(points[0][1], points[0][0]))
+        return ret
+
+    def clipEdge(self, points, axis, bound, lower):
+        """
+        `Author`: Bill Clark
+
+        One Sutherland Hodgman pass, keeping the part of a ring on one side of a single edge. Helper method to
+        clipRing.
+
+        `points`: The ring as lng, lat tuples, not closed.
+
+        `axis`: 0 if the edge is a line of constant longitude, 1 for latitude.
+
+        `bound`: The value of the edge along that axis.
+
+        `lower`: True if the inside is at or above the bound, false if it is at or below it.
+
+        `return`: The ring clipped to the edge, as lng, lat tuples.
+        """
+        ret = []
+        prev = points[-1]
+        prevIn = prev[axis] >= bound if lower else prev[axis] <= bound
+        for curr in points:
+            currIn = curr[axis] >= bound if lower else curr[axis] <= bound
+            if currIn != prevIn:
+                t = (bound - prev[axis]) / (curr[axis] - prev[axis])
+                if axis == 0:
+                    ret.append((bound, prev[1] + t * (curr[1] - prev[1])))
+                else:
+                    ret.append((prev[0] + t * (curr[0] - prev[0]), bound))
+            if currIn:
+                ret.append(curr)
+            prev, prevIn = curr, currIn
+        return ret
+
+    def clipLine(self, lats, lngs):
+        """
+        `Author`: Bill Clark
+
+        Liang Barsky clipping of an open line. Each segment is clipped on its own by narrowing the parametric range
+        that lies inside all four edges, and the visible segments are chained back together as they're found. A
+        line that leaves the rectangle and comes back is split, so the result is a list of pieces.
+
+        `lats`: The latitudes of the line, in order.
+
+        `lngs`: The longitudes of the line, in order.
+
+        `return`: A list of pieces, each a list of LatLongPoints. Empty if nothing is left.
+        """
+        west, south, east, north = self.west, self.south, self.east, self.north
+        if len(lats) == 1:
+            if west <= lngs[0] <= east and south <= lats[0] <= north:
+                return [[LatLongPoint(lats[0], lngs[0])]]
+            return []
+
+        pieces = []
+        piece = None
+        for i in xrange(len(lats) - 1):
+            x0, y0, x1, y1 = lngs[i], lats[i], lngs[i + 1], lats[i + 1]
+            dx, dy = x1 - x0, y1 - y0
+            t0, t1 = 0.0, 1.0
+            visible = 1
+            for p, q in ((-dx, x0 - west), (dx, east - x0), (-dy, y0 - south), (dy, north - y0)):
+                if p == 0:
+                    if q < 0:  # Parallel to this edge and outside it.
+                        visible = 0
+                        break
+                    continue
+                r = q / p
+                if p < 0:
+                    if r > t1:
+                        visible = 0
+                        break
+                    if r > t0: t0 = r
+                else:
+                    if r < t0:
+                        visible = 0
+                        break
+                    if r < t1: t1 = r
+
+            if not visible:
+                piece = None
+                continue
+            if piece is None or t0 > 0:  # The segment entered from outside, start a new piece.
+                piece = [(x0, y0) if t0 == 0 else (x0 + t0 * dx, y0 + t0 * dy)]
+                pieces.append(piece)
+            piece.append((x1, y1) if t1 == 1 else (x0 + t1 * dx, y0 + t1 * dy))
+            if t1 < 1:
+                piece = None
+
+        ret = []
+        for piece in pieces:
+            if len(set(piece)) > 1:  # Drop pieces that only touch the rectangle at a point.
+                ret.append([LatLongPoint(y, x) for x, y in piece])
+        return ret
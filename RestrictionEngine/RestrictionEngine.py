@@ -1,7 +1,11 @@
 from math import sqrt, log
 from WeilerAtherton import WeilerClipping
+from RectangleClipping import RectangleClipping
+from GeometricDataStructures.SpatialIndex import GeometricIndex, viewportBounds
+from GeometricDataStructures.Mercator import MercatorProjection
 
 ZOOM_CONSTANT = 10 + log(45, 2)  # Final Variable, Do Not Modify
+OUTSIDE, INSIDE, PARTIAL = 0, 1, 2  # Where a geometry's bounding box lies against a viewport, see classify.
 
 
 class RestrictionFactory(object):
@@ -31,6 +35,30 @@ class RestrictionFactory(object):
         """
         return WAClippingRestriction(viewport)
 
+    def newRectangleClipping(self, viewport):
+        """
+        `Author`: Bill Clark
+
+        See RectangleRestriction, this method returns a new instance of that object.
+        """
+        return RectangleRestriction(viewport)
+
+    def newSimplification(self, zoom, tolerance=1.0):
+        """
+        `Author`: Bill Clark
+
+        See SimplifyRestriction, this method returns a new instance of that object.
+        """
+        return SimplifyRestriction(zoom, tolerance)
+
+    def newComposite(self, *restrictions):
+        """
+        `Author`: Bill Clark
+
+        See CompositeRestriction, this method returns a new instance of that object.
+        """
+        return CompositeRestriction(*restrictions)
+
 
 class Restriction(object):
 
@@ -52,10 +80,72 @@ class Restriction(object):
         The primary method for a restriction. The only method that *should* be called from outside the class.
         Should modify the geometrics it gets, (not remove them) as the implementation chooses to do so.
 
-        `geometrics`: A list of geometric objects, which wrap an xml coordinate tag for easy access.
+        `geometrics`: A list of geometric objects, which wrap an xml coordinate tag for easy access. Viewport
+                      restrictions also take a GeometricIndex, see candidates.
         """
         pass
 
+    def clip(self, geometrics):
+        """
+        `Author`: Bill Clark
+
+        The non destructive version of restrict. The restriction is run on copies of the geometrics, down to their
+        points, and what it leaves is returned as a RestrictionResult, so the geometrics and their xml are never
+        changed. One parsed file can be clipped to any number of viewports this way, at once from several threads if
+        need be, with a restriction for each. See ClippingBenchmark.checkClip.
+
+        `geometrics`: A list of geometric objects or a GeometricIndex. Only the geometrics an index finds in the
+                      viewport are copied.
+
+        `return`: A RestrictionResult.
+        """
+        viewport = getattr(self, 'viewport', None)
+        if isinstance(geometrics, GeometricIndex) and viewport is not None:
+            sources = geometrics.query(viewportBounds(viewport))
+        else:
+            sources = [x for x in geometrics if not x.remove == len(x.coordinates)]
+        clipped = [x.copy(x.element) for x in sources]
+        self.restrict(clipped)
+        return RestrictionResult(sources, clipped)
+
+    def candidates(self, geometrics):
+        """
+        `Author`: Bill Clark
+
+        Narrows what a viewport restriction has to visit. A list is returned as is. A GeometricIndex is narrowed
+        to the geometrics in this restriction's viewport, see GeometricIndex.narrow. Every other geometric in it is
+        never looked at, and is flagged for removal when KmlFasade.fasadeUpdate releases the index, the same result
+        the restriction would have come to.
+
+        `geometrics`: A list of geometric objects or a GeometricIndex.
+
+        `return`: The geometrics the restriction needs to examine.
+        """
+        if not isinstance(geometrics, GeometricIndex):
+            return geometrics
+        return geometrics.narrow(viewportBounds(self.viewport))
+
+    def classify(self, geometry):
+        """
+        `Author`: Bill Clark
+
+        Compares a geometry's cached bounding box against this restriction's NW and SE corners. Lets a restriction
+        reject or accept a whole geometry in constant time, leaving vertex level work to the few that straddle the
+        viewport edge. The edges are inclusive, the same as pointWithinCorners.
+
+        `geometry`: A geometric object.
+
+        `return`: OUTSIDE, INSIDE, or PARTIAL. Geometries without coordinates are PARTIAL, left to the restriction.
+        """
+        if geometry.bounds is None:
+            return PARTIAL
+        west, south, east, north = geometry.bounds
+        if east < self.NW.lng or west > self.SE.lng or north < self.SE.lat or south > self.NW.lat:
+            return OUTSIDE
+        if west >= self.NW.lng and east <= self.SE.lng and south >= self.SE.lat and north <= self.NW.lat:
+            return INSIDE
+        return PARTIAL
+
     def zoom(self, width):
         """
         `Author`: Nick LaPosta
@@ -71,6 +161,183 @@ class Restriction(object):
         return zoom_level, filter_range
 
 
+class RestrictionResult(object):
+
+    def __init__(self, sources, clipped):
+        """
+        `Author`: Bill Clark
+
+        What a restriction's clip left of a set of geometrics. Each geometric that survived maps to its pieces,
+        the coordinates it was clipped to followed by any it was split into. The result iterates as geometrics of
+        its own, one per piece, so it can be handed straight to UrlBuilder.addGeometrics or a Rasterizer, and
+        KmlFasade.writeResult writes it out as kml.
+
+        `sources`: The geometrics given to the clip.
+
+        `clipped`: The restricted copies of the sources, in the same order.
+        """
+        self.sources = []
+        self.pieces = {}  # The pieces of each surviving source, by id.
+        self.geometrics = []
+        for source, geometry in zip(sources, clipped):
+            if geometry.remove == len(geometry.coordinates):
+                continue
+            pieces = [geometry.coordinates] + geometry.pieces
+            self.sources.append(source)
+            self.pieces[id(source)] = pieces
+            geometry.pieces = []
+            geometry.remove = 0
+            self.geometrics.append(geometry)
+            for piece in pieces[1:]:
+                part = geometry.copy(geometry.element)
+                part.setCoordinates(piece)
+                self.geometrics.append(part)
+
+    def piecesOf(self, geometry):
+        """
+        `Author`: Bill Clark
+
+        `geometry`: One of the geometrics given to the clip.
+
+        `return`: A list of the geometry's pieces, each a sequence of coordinates. None if it was removed.
+        """
+        return self.pieces.get(id(geometry))
+
+    def __len__(self):
+        return len(self.geometrics)
+
+    def __iter__(self):
+        return iter(self.geometrics)
+
+
+class CompositeRestriction(Restriction):
+
+    def __init__(self, *restrictions):
+        """
+        `Author`: Bill Clark
+
+        Runs several restrictions as one, each in the order given. Lets a clip and a simplification share a
+        single pass, such as the one made by KmlFasade.streamPlacemarks.
+
+        `restrictions`: The restrictions to run.
+        """
+        super(CompositeRestriction, self).__init__(0)
+        self.restrictions = restrictions
+        viewports = [x.viewport for x in restrictions if getattr(x, 'viewport', None) is not None]
+        self.viewport = viewports[0] if viewports else None  # Narrows clip, nothing outside it survives the first.
+
+    def restrict(self, geometrics):
+        """
+        `Author`: Bill Clark
+
+        Calls restrict on each restriction in turn, with the same geometrics.
+
+        `geometrics`: list of geometric objects, or a GeometricIndex.
+        """
+        for restriction in self.restrictions:
+            restriction.restrict(geometrics)
+
+
+class SimplifyRestriction(Restriction):
+
+    def __init__(self, zoom, tolerance=1.0):
+        """
+        `Author`: Bill Clark
+
+        Removes the vertices of lines and rings that make no visible difference at a zoom level, with the
+        Douglas Peucker algorithm. The work is done in the pixel space of the zoom, so the tolerance is a distance
+        on the rendered map; a lower zoom covers more ground per pixel and lets more vertices go.
+
+        `zoom`: The zoom level the geometry will be drawn at, as given to the static maps api.
+
+        `tolerance`: How far, in pixels at that zoom, a vertex can be from the simplified line and be removed.
+        """
+        super(SimplifyRestriction, self).__init__(0)
+        self.zoom = zoom
+        self.tolerance = tolerance
+        self.projection = MercatorProjection()
+
+    def restrict(self, geometrics):
+        """
+        `Author`: Bill Clark
+
+        Simplifies every LineString, LinearRing and Polygon that isn't flagged for removal, along with any pieces a
+        clip split them into. Points are left alone. Rings keep their closing vertex, and a ring that would be
+        reduced below a triangle is left as it was.
+
+        `geometrics`: list of geometric objects, or a GeometricIndex, which is simplified whole.
+        """
+        for geometry in geometrics:
+            if geometry.tag == 'Point' or geometry.remove == len(geometry.coordinates):
+                continue
+            ring = not geometry.tag == 'LineString'
+            xs, ys = geometry.pixelCoordinates(self.projection, self.zoom)
+            kept = self.simplify(xs, ys, ring)
+            if len(kept) < len(geometry.coordinates):
+                geometry.setCoordinates([geometry.coordinates[i] for i in kept])
+            geometry.remove = 0
+
+            for p, piece in enumerate(geometry.pieces):
+                xs, ys = self.projection.from_lat_lng_arrays_to_points([x.lat for x in piece],
+                                                                         [x.lng for x in piece], self.zoom)
+                geometry.pieces[p] = [piece[i] for i in self.simplify(xs, ys, ring)]
+
+    def simplify(self, xs, ys, ring=0):
+        """
+        `Author`: Bill Clark
+
+        Runs Douglas Peucker over one line of pixel coordinates. A ring is first split at the vertex furthest from
+        its start, so both halves have a chord to measure against. Helper method to restrict.
+
+        `xs`: The x pixel coordinates.
+
+        `ys`: The y pixel coordinates.
+
+        `ring`: flag for a closed ring rather than an open line.
+
+        `return`: The indexes of the vertices to keep, in order.
+        """
+        xs, ys = list(xs), list(ys)
+        last = len(xs) - 1
+        if last < 2 or (ring and last < 4):
+            return range(last + 1)
+
+        keep = [0] * (last + 1)
+        keep[0] = keep[last] = 1
+        if ring:
+            far = max(xrange(1, last), key=lambda i: (xs[i] - xs[0]) ** 2 + (ys[i] - ys[0]) ** 2)
+            keep[far] = 1
+            stack = [(0, far), (far, last)]
+        else:
+            stack = [(0, last)]
+
+        limit = self.tolerance * self.tolerance
+        while stack:
+            first, end = stack.pop()
+            ax, ay = xs[first], ys[first]
+            dx, dy = xs[end] - ax, ys[end] - ay
+            length = dx * dx + dy * dy
+            furthest, index = -1, None
+            for i in xrange(first + 1, end):
+                px, py = xs[i] - ax, ys[i] - ay
+                if length:
+                    cross = px * dy - py * dx
+                    distance = cross * cross / length
+                else:  # The chord is a single point, as with a ring's start and end.
+                    distance = px * px + py * py
+                if distance > furthest:
+                    furthest, index = distance, i
+            if index is not None and furthest > limit:
+                keep[index] = 1
+                stack.append((first, index))
+                stack.append((index, end))
+
+        ret = [i for i in xrange(last + 1) if keep[i]]
+        if ring and len(ret) < 4:
+            return range(last + 1)
+        return ret
+
+
 class WAClippingRestriction(Restriction):
 
     def __init__(self, viewport):
@@ -79,7 +346,7 @@ class WAClippingRestriction(Restriction):
 
         This method uses the weiler atherton algorithm module to clip geometrics. Any points and lines
         within the viewport's corners are left in the geometric, everything else is removed. The polygon
-        is closed as well.
+        is closed as well. LineStrings are open, so they're clipped as lines instead, see restrict.
 
         `Viewport`: = The return from the get_corners method of the mercator module. This is the 4 points
         that make up the corner of the viewport.
@@ -88,6 +355,7 @@ class WAClippingRestriction(Restriction):
         self.viewport = viewport
         self.NW = self.viewport[1]
         self.SE = self.viewport[3]
+        self.lineClipper = RectangleClipping(viewport)
 
     def restrict(self, geometrics):
         """
@@ -97,31 +365,66 @@ class WAClippingRestriction(Restriction):
         the coordinates in the geometry are checked for two things; being within the viewport of the
         Restriction and if the point is an entry point. An entry point is required for WA clipping to work,
         simply a point that the prior point was not in the viewport. After the iteration, any geometry that is
-        partially in the viewport is clipped via the WeilerAtherton module.
+        partially in the viewport is clipped via the WeilerAtherton module. Geometries whose bounding box is wholly
+        inside or outside the viewport are settled without the iteration. A LineString is not a polygon and
+        closing it would be wrong, so a partial one is clipped as an open line in one pass instead, and split into a
+        piece for each run inside the viewport.
 
-        `geometrics`: list of geometric objects.
+        `geometrics`: list of geometric objects, or a GeometricIndex.
         """
         atherton = WeilerClipping()
-        for geometry in geometrics:
-            last_pos = -1
-            startCoord = 0
-            count = 0
-            for coordin in geometry.coordinates:
-                count = count+1
-                if not self.pointWithinCorners(coordin):
-                    geometry.remove += 1
-                    curr_pos = 0
-                else: curr_pos = 1
-
-                if last_pos == 0 and curr_pos == 1:
-                    startCoord = geometry.coordinates.index(coordin)-1
-                last_pos = curr_pos
+        for geometry in self.candidates(geometrics):
+            position = self.classify(geometry)
+            if position == OUTSIDE:
+                geometry.remove = len(geometry.coordinates)
+                continue
+            elif position == INSIDE:
+                continue
+
+            if geometry.tag == 'LineString':
+                pieces = self.lineClipper.clipLine(*geometry.latLngArrays())
+                if pieces:
+                    geometry.setPieces(pieces)
+                else:
+                    geometry.remove = len(geometry.coordinates)
+                continue
+
+            startCoord, outside = self.findEntry(geometry)
+            geometry.remove += outside
 
             length = len(geometry.coordinates)
-            geometry.coordinates[:] = geometry.coordinates[-(length - startCoord):] + geometry.coordinates[:startCoord]
+            if startCoord:
+                geometry.setCoordinates(geometry.coordinates[startCoord:] + geometry.coordinates[:startCoord])
             if not length == geometry.remove and not geometry.remove == 0:  # Completely in/outside the viewport.
-                newgeometry = atherton.clip(geometry.coordinates, self.viewport)
-                geometry.coordinates[:] = newgeometry
+                newgeometry = atherton.clip(list(geometry.coordinates), self.viewport)
+                geometry.setCoordinates(newgeometry)
+
+    def findEntry(self, geometry):
+        """
+        `Author`: Bill Clark
+
+        Finds the entry point of a geometry and counts its coordinates outside the viewport, in a single pass.
+        The entry point is the coordinate before the last one where the geometry comes back into the viewport.
+        It is found by its position in the pass rather than by searching for the point, so a repeated coordinate,
+        like the closing point of a ring, can't send the rotation to the wrong vertex. Helper method to restrict.
+
+        `geometry`: A geometric object.
+
+        `return`: A tuple of the entry point's index, 0 when there is none, and the number of coordinates outside.
+        """
+        west, north, east, south = self.NW.lng, self.NW.lat, self.SE.lng, self.SE.lat
+        lats, lngs = geometry.latLngArrays()
+        startCoord = 0
+        outside = 0
+        last_in = 1
+        for i in xrange(len(lats)):
+            curr_in = west <= lngs[i] <= east and south <= lats[i] <= north
+            if not curr_in:
+                outside += 1
+            elif not last_in and i:
+                startCoord = i - 1
+            last_in = curr_in
+        return startCoord, outside
 
     def pointWithinCorners(self, coordinates):
         """
@@ -140,6 +443,56 @@ class WAClippingRestriction(Restriction):
         return False
 
 
+class RectangleRestriction(Restriction):
+
+    def __init__(self, viewport):
+        """
+        `Author`: Bill Clark
+
+        Clips geometrics to the viewport like WAClipping, but with the RectangleClipping module, which only handles
+        axis aligned rectangles and is much quicker for it. Rings and polygons are clipped whole. Lines are clipped
+        as open lines, and a line that leaves the viewport and comes back is split into pieces.
+
+        `Viewport`: = The return from the get_corners method of the mercator module. This is the 4 points
+        that make up the corner of the viewport.
+        """
+        super(RectangleRestriction, self).__init__(0)
+        self.viewport = viewport
+        self.NW = self.viewport[1]
+        self.SE = self.viewport[3]
+        self.clipper = RectangleClipping(viewport)
+
+    def restrict(self, geometrics):
+        """
+        `Author`: Bill Clark
+
+        Geometries whose bounding box is wholly inside the viewport are kept and those wholly outside are removed,
+        without looking at their vertices. The rest are clipped; a LineString with Liang Barsky, which may leave
+        it in several pieces, anything else as a ring with Sutherland Hodgman.
+
+        `geometrics`: list of geometric objects, or a GeometricIndex.
+        """
+        for geometry in self.candidates(geometrics):
+            position = self.classify(geometry)
+            if position == OUTSIDE:
+                geometry.remove = len(geometry.coordinates)
+                continue
+            elif position == INSIDE:
+                continue
+
+            lats, lngs = geometry.latLngArrays()
+            if geometry.tag == 'LineString':
+                pieces = self.clipper.clipLine(lats, lngs)
+            else:
+                ring = self.clipper.clipRing(lats, lngs)
+                pieces = [ring] if ring else []
+
+            if pieces:
+                geometry.setPieces(pieces)
+            else:
+                geometry.remove = len(geometry.coordinates)
+
+
 class SquareRestriction(Restriction):
 
     def __init__(self, viewport):
@@ -168,21 +521,19 @@ class SquareRestriction(Restriction):
 
         This method restricts based off of the NW and SE values this object contains. It looks at each point
         in a geometric and checks to see if it's contained by the lines drawn from NW and SE. If it's contained,
-        we know that the point is in our frame of mind.
+        we know that the point is in our frame of mind. The check is made against the geometric's cached bounding
+        box, a geometry is kept only if the whole box is contained.
 
-        `geometrics`: A list of geometric objects, which wrap an xml coordinate tag for easy access.
+        `geometrics`: A list of geometric objects, which wrap an xml coordinate tag for easy access, or a
+                      GeometricIndex.
         """
-        for geometry in geometrics:
+        for geometry in self.candidates(geometrics):
             if geometry.tag == "Point":
-                if not self.pointWithinCorners(geometry.coordinates[0]):
+                if not self.classify(geometry) == INSIDE:
                     geometry.remove = 1
             elif geometry.tag == "LineString" or geometry.tag == "LinearRing" or geometry.tag == "Polygon":
-                for coord in geometry.coordinates:
-                    if self.pointWithinCorners(coord):
-                        pass
-                    else:
-                        geometry.remove = len(geometry.coordinates)
-                        break
+                if not self.classify(geometry) == INSIDE:  # Some vertex lies outside the corners.
+                    geometry.remove = len(geometry.coordinates)
             else:
                 print "uh oh spagettios."
 
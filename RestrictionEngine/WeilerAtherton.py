@@ -146,11 +146,13 @@ class WeilerClipping:
         result = []
         reserve = Ie[-1]
         location = reserve
+        Pindex = self.indexPoints(P)
+        Qindex = self.indexPoints(Q)
         flag = 1
         while flag:
             Ie.pop()
             end = Ie[-1]
-            index = P.index(location)
+            index = Pindex[location.key] if location.key in Pindex else P.index(location)
             while not location == end:
                 location.rewrap()
                 result.append(location)
@@ -164,7 +166,7 @@ class WeilerClipping:
             else:
                 end = Ie[-1]
 
-            index = Q.index(location)
+            index = Qindex[location.key] if location.key in Qindex else Q.index(location)
             while not location == end:
                 location.rewrap()
                 result.append(location)
@@ -172,6 +174,23 @@ class WeilerClipping:
                 location = Q[index]
         return result
 
+    def indexPoints(self, points):
+        """
+        `Author`: Bill Clark
+
+        Maps each point's key to the first position it holds in the given list, the same answer list.index gives,
+        so getClipped can find its place in P and Q with a dict lookup instead of a scan. A point moved by a rewrap
+        after this is built won't be found; getClipped falls back to the scan for it.
+
+        `points`: A list of LatLongPoints.
+
+        `return`: A dict of point key to index.
+        """
+        ret = {}
+        for i, point in enumerate(points):
+            ret.setdefault(point.key, i)
+        return ret
+
     def getP(self, subjectlines, viewportlines):
         """
         'Author' Bob S. Nick L. and Bill C.
@@ -265,10 +284,10 @@ class WeilerClipping:
             if (p[0].lng * p[1].lng) < 0:    # if one is negative and the other positive
                 if p[0].lng > p[1].lng:
                     if p[0].lng - p[1].lng > 180:
-                        p[1].lng = p[1].lng + 360
+                        p[1].shift(360)
                 elif p[1].lng > p[0].lng:
                     if p[1].lng - p[0].lng > 180:
-                        p[0].lng = p[0].lng + 360
+                        p[0].shift(360)
 
     def rewrap(self, list):
         """
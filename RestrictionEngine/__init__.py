@@ -1,4 +1,5 @@
 import RestrictionEngine
 import WeilerAtherton
+import RectangleClipping
 
-__all__ = ["RestrictionEngine",  "WeilerAtherton"]
+__all__ = ["RestrictionEngine",  "WeilerAtherton", "RectangleClipping"]
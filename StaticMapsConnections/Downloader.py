@@ -0,0 +1,172 @@
+import httplib
+import threading
+from Queue import Queue
+from time import sleep, time
+from urlparse import urlsplit
+from Observations.Observer import Observable
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Responses worth asking again for, the rest fail at once.
+
+
+class Downloader(Observable):
+
+    def __init__(self, workers=4, rate=None, retries=3, backoff=0.5, timeout=30):
+        """
+        `Author`: Bill Clark
+
+        Downloads a set of urls at once from a pool of threads. Each thread keeps its connections open between
+        requests, so the images of one run share a handful of keep alive connections rather than opening one each.
+        Requests can be spaced out to a rate limit, and failed requests are tried again after a growing wait.
+        Progress is reported through setStatus, from the calling thread only, so observers such as the ui don't
+        have to be thread safe.
+
+        `workers`: The number of threads downloading at once.
+
+        `rate`: The most requests to start a second, across all threads. None for no limit.
+
+        `retries`: How many times to try a request again after it fails.
+
+        `backoff`: The wait in seconds before the first retry. It doubles for each retry after.
+
+        `timeout`: The seconds a connection waits on the server before the request fails.
+        """
+        super(Downloader, self).__init__()
+        self.workers = workers
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.nextStart = 0
+
+    def download(self, jobs):
+        """
+        `Author`: Bill Clark
+
+        Downloads each url to its path. The jobs are shared out to the threads as they come free, and each result
+        is reported as it arrives.
+
+        `jobs`: A list of tuples of a url and the file path to save it to. A path of None keeps the image in memory.
+
+        `return`: The file paths, or the image data for jobs without one, in the order of the jobs. Raises IOError
+                  if any url could not be downloaded, after the rest have finished.
+        """
+        tasks = Queue()
+        results = Queue()
+        for position, job in enumerate(jobs):
+            tasks.put((position, job))
+        threads = []
+        for _ in xrange(min(self.workers, len(jobs))):
+            tasks.put(None)
+            thread = threading.Thread(target=self.work, args=(tasks, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        ret = [None] * len(jobs)
+        errors = []
+        for count in xrange(1, len(jobs) + 1):
+            position, result, error = results.get()
+            if error is None:
+                ret[position] = result
+                self.setStatus('Downloaded {} of {} Images.'.format(count, len(jobs)))
+            else:
+                errors.append(error)
+                self.setStatus('Failed to download {}: {}'.format(jobs[position][0], error))
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise IOError('{} of {} images failed to download.'.format(len(errors), len(jobs)))
+        return ret
+
+    def work(self, tasks, results):
+        """
+        `Author`: Bill Clark
+
+        The loop each thread runs, taking jobs until it finds the None that ends it. The thread's connections
+        are kept by host and reused for every job it takes. Helper method to download.
+
+        `tasks`: The queue of positions and jobs.
+
+        `results`: The queue each position is put on with its result, or with the error that stopped it.
+        """
+        connections = {}
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                position, (url, path) = task
+                try:
+                    results.put((position, self.fetch(connections, url, path), None))
+                except Exception as e:
+                    results.put((position, path, e))
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    def fetch(self, connections, url, path):
+        """
+        `Author`: Bill Clark
+
+        Gets one url and writes the response body to a path, trying again on a dropped connection or a server
+        error. A connection that fails is closed and dropped, the next try opens a fresh one. Helper method to work.
+
+        `connections`: The thread's open connections, by scheme, host and port.
+
+        `url`: The url to get, http or https.
+
+        `path`: The file to write, or None to return the data instead.
+
+        `return`: The path, or the data when there is no path.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path + ('?' + parts.query if parts.query else '')
+        wait = self.backoff
+        for attempt in xrange(self.retries + 1):
+            if attempt:
+                sleep(wait)
+                wait *= 2
+            self.throttle()
+            connection = connections.get(key)
+            if connection is None:
+                make = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+                connection = connections[key] = make(parts.netloc, timeout=self.timeout)
+            try:
+                connection.request('GET', target)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, IOError) as e:
+                connection.close()
+                del connections[key]
+                error = e
+                continue
+
+            if response.status == 200:
+                if path is None:
+                    return body
+                with open(path, 'wb') as output:
+                    output.write(body)
+                return path
+            error = IOError('HTTP {} {}'.format(response.status, response.reason))
+            if response.status not in RETRY_STATUSES:
+                break
+        raise error
+
+    def throttle(self):
+        """
+        `Author`: Bill Clark
+
+        Holds the calling thread until it may start a request under the rate limit. Each thread claims the next
+        free start time under a lock, then waits for it outside the lock. Helper method to fetch.
+        """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time()
+            start = max(now, self.nextStart)
+            self.nextStart = start + 1.0 / self.rate
+        if start > now:
+            sleep(start - now)
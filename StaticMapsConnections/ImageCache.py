@@ -0,0 +1,242 @@
+import os
+import re
+import errno
+import shutil
+import tempfile
+from hashlib import sha1
+from time import time
+
+KEY_PARAM = re.compile(r'&*key=[^&]*')  # The api key, left out of cache keys so a new key doesn't empty the cache.
+HEADROOM = 0.9  # The fraction of maxBytes an eviction brings the cache down to, so a full cache isn't rescanned often.
+
+
+class ImageCache(object):
+
+    def __init__(self, directory=os.path.join('Inputs', 'Static Maps', 'Cache'), maxBytes=200 * 1024 * 1024,
+                 ttl=None):
+        """
+        `Author`: Bill Clark
+
+        An on disk cache of downloaded static map images. Each image is stored under the sha1 of its exact url,
+        without the api key, so the same center, zoom, size and paths are only ever downloaded once. When the cache
+        outgrows its size the least recently used images are removed. An image's modification time is when it was
+        downloaded, which the ttl is measured from, and its access time is when it was last used.
+        The size is counted from the folder once, at the first store, and kept up to date from then on, so the
+        folder is only scanned again when the cache goes over, and then brought down to HEADROOM of its size.
+
+        `directory`: The folder the images are kept in. Made if it doesn't exist.
+
+        `maxBytes`: The most the cached images may take on disk.
+
+        `ttl`: The seconds an image stays fresh. None to keep images until they're evicted.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.used = None  # Bytes the cached images take, None until the first store counts them.
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, url):
+        """
+        `Author`: Bill Clark
+
+        `url`: A static maps url.
+
+        `return`: The sha1 hex digest of the url, with the api key removed.
+        """
+        return sha1(KEY_PARAM.sub('', url)).hexdigest()
+
+    def location(self, url):
+        """
+        `Author`: Bill Clark
+
+        `url`: A static maps url.
+
+        `return`: The path the url's image is cached at.
+        """
+        return os.path.join(self.directory, self.key(url) + '.png')
+
+    def get(self, url, path):
+        """
+        `Author`: Bill Clark
+
+        Looks for a fresh cached image of the url. On a hit the image is copied to the path asked for, the merger
+        writes its converted files beside its inputs and they shouldn't land in the cache, and marked as used. See
+        touch.
+
+        `url`: The url of the image.
+
+        `path`: Where the image is wanted.
+
+        `return`: The path on a hit, None on a miss.
+        """
+        cached = self.location(url)
+        try:
+            if self.ttl is not None and time() - os.path.getmtime(cached) > self.ttl:
+                self.discard(cached)
+                return None
+            shutil.copyfile(cached, path)
+            self.touch(cached)
+        except (IOError, OSError):
+            return None
+        return path
+
+    def read(self, url):
+        """
+        `Author`: Bill Clark
+
+        The in memory version of get.
+
+        `url`: The url of the image.
+
+        `return`: The image data on a hit, None on a miss.
+        """
+        cached = self.location(url)
+        try:
+            if self.ttl is not None and time() - os.path.getmtime(cached) > self.ttl:
+                self.discard(cached)
+                return None
+            with open(cached, 'rb') as image:
+                data = image.read()
+            self.touch(cached)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def touch(self, cached):
+        """
+        `Author`: Bill Clark
+
+        Marks a cached image as used, setting its access time to now. The modification time is kept, so using an
+        image doesn't keep it fresh past the ttl.
+
+        `cached`: The path of the cached image.
+        """
+        os.utime(cached, (time(), os.path.getmtime(cached)))
+
+    def write(self, url, data):
+        """
+        `Author`: Bill Clark
+
+        The in memory version of put.
+
+        `url`: The url the image was downloaded from.
+
+        `data`: The image data.
+        """
+        image, temporary = self.temporary()
+        with image:
+            image.write(data)
+        self.store(temporary, self.location(url))
+
+    def put(self, url, path):
+        """
+        `Author`: Bill Clark
+
+        Stores a downloaded image under its url, then evicts images if the cache is over its size. The copy is
+        written to a temporary file of its own first, so a reader never sees half an image, even with several
+        processes sharing the cache.
+
+        `url`: The url the image was downloaded from.
+
+        `path`: The downloaded image.
+        """
+        image, temporary = self.temporary()
+        with image, open(path, 'rb') as source:
+            shutil.copyfileobj(source, image)
+        self.store(temporary, self.location(url))
+
+    def temporary(self):
+        """
+        `Author`: Bill Clark
+
+        Makes a uniquely named file in the cache folder to write an image to before it's moved into place, so
+        processes storing the same url never write to the same file. Helper method to put and write.
+
+        `return`: A tuple of the file, open for writing, and its path.
+        """
+        handle, path = tempfile.mkstemp('.tmp', dir=self.directory)
+        return os.fdopen(handle, 'wb'), path
+
+    def store(self, temporary, cached):
+        """
+        `Author`: Bill Clark
+
+        Moves a written image into its place in the cache and adds it to the count of bytes used, evicting only
+        when the count goes over maxBytes. If another process put the same image in place first, which the
+        rename can refuse to replace on windows, that copy is kept and this one dropped. Helper method to put
+        and write.
+
+        `temporary`: The image, written under a temporary name.
+
+        `cached`: Where the image is cached.
+        """
+        if self.used is None:
+            self.evict()
+        if os.path.exists(cached):
+            self.discard(cached)
+        size = os.path.getsize(temporary)
+        try:
+            os.rename(temporary, cached)
+        except OSError:
+            if not os.path.exists(cached):
+                raise
+            os.remove(temporary)
+            return
+        self.used += size
+        if self.used > self.maxBytes:
+            self.evict()
+
+    def discard(self, cached):
+        """
+        `Author`: Bill Clark
+
+        Removes a cached image and takes it off the count of bytes used. An image another process already removed
+        is left as gone.
+
+        `cached`: The path of the cached image.
+        """
+        try:
+            size = os.path.getsize(cached)
+            os.remove(cached)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return
+        if self.used is not None:
+            self.used -= size
+
+    def evict(self):
+        """
+        `Author`: Bill Clark
+
+        If the cache is over maxBytes, removes the least recently used images until it fits within HEADROOM of
+        maxBytes. Either way the bytes used are recounted. Scans the whole folder, store calls it only when the
+        count is missing or over.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.png'):
+                continue
+            entry = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(entry)
+            except OSError as error:  # Removed by another process since the listing.
+                if error.errno != errno.ENOENT:
+                    raise
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry))
+            total += stat.st_size
+        entries.sort()
+        if total > self.maxBytes:
+            while total > self.maxBytes * HEADROOM and entries:
+                atime, size, entry = entries.pop(0)
+                try:
+                    os.remove(entry)
+                except OSError as error:
+                    if error.errno != errno.ENOENT:
+                        raise
+                total -= size
+        self.used = total
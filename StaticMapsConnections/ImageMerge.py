@@ -1,6 +1,13 @@
+from cStringIO import StringIO
+from multiprocessing import Pool
 from PIL import Image
 from Observations.Observer import Observable
 
+try:
+    import numpy
+except ImportError:  # The merges fall back to comparing pixel by pixel.
+    numpy = None
+
 debug = 0
 diffnum = 50
 
@@ -26,14 +33,29 @@ class Merger(Observable):
 
         super(Merger, self).__init__()
         self.mcount = 0
-        base = self.convertAll(base)
-        self.baseimage = Image.open(base[0])
-        self.basedata = self.baseimage.load()
-        self.baseimage.save(outfile)
+        self.changed = 0  # The pixels copied from the layers, summed over every layer merged.
         self.outfile = outfile
-        self.base = base
+        self.baseimage = self.load(base)
+        self.basedata = self.baseimage.load()
+        self.basearray = numpy.asarray(self.baseimage, dtype=numpy.int16) if numpy is not None else None
         self.setStatus("Initialized.")
 
+    def load(self, base):
+        """
+        `Author`: Bill Clark
+
+        Converts the base image and saves it to the outfile, where the layers are merged. Helper method to the
+        constructor, MemoryMerger overrides it to keep the image in memory.
+
+        `base`: The path of the base image.
+
+        `return`: The base image.
+        """
+        self.base = self.convertAll(base)
+        ret = Image.open(self.base[0])
+        ret.save(self.outfile)
+        return ret
+
     def merge(self, new):
         """
         `Author`: Bill Clark
@@ -53,17 +75,8 @@ class Merger(Observable):
         trackedimage = Image.open(self.outfile)
         topimage = Image.open(new)
 
-        trackeddata = trackedimage.load()
-        topdata = topimage.load()
-        
-        counter = 0
-        for x in range(self.baseimage.size[0]):
-            for y in range(self.baseimage.size[1]):
-                bpix = self.basedata[x,y]
-                tpix = topdata[x,y]
-                if abs(bpix[0] - tpix[0]) > diffnum or abs(bpix[1] - tpix[1]) > diffnum or abs(bpix[2] - tpix[2]) > diffnum:
-                    trackeddata[x,y] = tpix
-                    counter += 1
+        trackedimage, counter = self.overlay(trackedimage, topimage)
+        self.changed += counter
 
         if debug: print "Different Pixels:", counter, repr(round((counter/360000.)*100,2)) + '%', " Same Pixels:", \
             360000-counter, repr(round(((360000-counter)/360000.)*100,2)) + '%'
@@ -90,21 +103,11 @@ class Merger(Observable):
 
         trackedimage = Image.open(self.outfile)
 
-        trackeddata = trackedimage.load()
         count = 0
         for top in images:
             topimage = Image.open(top)
-            topdata = topimage.load()
-            counter = 0
-
-
-            for x in range(self.baseimage.size[0]):
-                for y in range(self.baseimage.size[1]):
-                    bpix = self.basedata[x,y]
-                    tpix = topdata[x,y]
-                    if abs(bpix[0] - tpix[0]) > diffnum or abs(bpix[1] - tpix[1]) > diffnum or abs(bpix[2] - tpix[2]) > diffnum:
-                        trackeddata[x,y] = tpix
-                        counter += 1
+            trackedimage, counter = self.overlay(trackedimage, topimage)
+            self.changed += counter
 
             if debug: print "Different Pixels:", counter, repr(round((counter/360000.)*100,2)) + '%', " Same Pixels:", \
                 360000-counter, repr(round(((360000-counter)/360000.)*100,2)) + '%'
@@ -117,6 +120,64 @@ class Merger(Observable):
         self.setStatus("{} Images Merged Successfully.".format(self.mcount), self.mcount)
         trackedimage.save(self.outfile)
 
+    def overlay(self, trackedimage, topimage, color=None):
+        """
+        `Author`: Bill Clark
+
+        Finds the pixels of a layer that differ from the base by more than diffnum in any of red, green or blue, and
+        copies them onto the tracked image. With NumPy the whole image is compared at once as arrays, without it
+        pixel by pixel. Both give the same image. Helper to the merge methods.
+
+        `trackedimage`: The image being merged onto.
+
+        `topimage`: The layer, lined up with the base image.
+
+        `color`: A color to mark the differing pixels with, rather than copying the layer's. Used by blkDiff.
+
+        `return`: A tuple of the tracked image with the changes, which may be a new image, and the pixels changed.
+        """
+        if numpy is not None:
+            return self.overlayArrays(trackedimage, topimage, color)
+        return self.overlayPixels(trackedimage, topimage, color)
+
+    def overlayArrays(self, trackedimage, topimage, color=None):
+        """
+        `Author`: Bill Clark
+
+        The NumPy version of overlay. The difference mask is taken over every pixel in a few array operations.
+
+        `return`: A tuple of a new tracked image and the pixels changed.
+        """
+        tracked = numpy.array(trackedimage)
+        top = numpy.asarray(topimage)
+        mask = (numpy.abs(self.basearray[..., :3] - top[..., :3]) > diffnum).any(axis=-1)
+        if color is None:
+            tracked[mask] = top[mask]
+        else:
+            tracked[mask] = color[:tracked.shape[-1]]
+        return Image.fromarray(tracked, trackedimage.mode), int(mask.sum())
+
+    def overlayPixels(self, trackedimage, topimage, color=None):
+        """
+        `Author`: Bill Clark
+
+        The pixel by pixel version of overlay, for when NumPy isn't installed. Changes the tracked image in place.
+
+        `return`: A tuple of the tracked image and the pixels changed.
+        """
+        trackeddata = trackedimage.load()
+        topdata = topimage.load()
+
+        counter = 0
+        for x in range(self.baseimage.size[0]):
+            for y in range(self.baseimage.size[1]):
+                bpix = self.basedata[x,y]
+                tpix = topdata[x,y]
+                if abs(bpix[0] - tpix[0]) > diffnum or abs(bpix[1] - tpix[1]) > diffnum or abs(bpix[2] - tpix[2]) > diffnum:
+                    trackeddata[x,y] = tpix if color is None else color
+                    counter += 1
+        return trackedimage, counter
+
     def convertAll(self, *images):
         """
         `Author`: Bill Clark
@@ -155,19 +216,9 @@ class Merger(Observable):
         """
 
         trackedimage = Image.open(self.outfile)
-        trackeddata = trackedimage.load()
-
         topimage = Image.open(images)
-        topdata = topimage.load()
-        counter = 0
 
-        for x in range(self.baseimage.size[0]):
-            for y in range(self.baseimage.size[1]):
-                bpix = self.basedata[x,y]
-                tpix = topdata[x,y]
-                if abs(bpix[0] - tpix[0]) > diffnum or abs(bpix[1] - tpix[1]) > diffnum or abs(bpix[2] - tpix[2]) > diffnum:
-                    trackeddata[x,y] = (0,0,0,255)
-                    counter += 1
+        trackedimage, counter = self.overlay(trackedimage, topimage, (0,0,0,255))
 
         if debug: print "Different Pixels:", counter, repr(round((counter/360000.)*100,2)) + '%', " Same Pixels:", \
             360000-counter, repr(round(((360000-counter)/360000.)*100,2)) + '%'
@@ -176,6 +227,171 @@ class Merger(Observable):
         if debug: print ""
         trackedimage.save(self.outfile)
 
+
+class MemoryMerger(Merger):
+
+    def __init__(self, base, processes=1):
+        """
+        `Author`: Bill Clark
+
+        A Merger that works in memory. Each image is decoded once and converted to RGBA as it's read, without the
+        .con files, and the layers are merged into one image held by the object. Nothing is written until save.
+        The images can be paths, or the data itself, such as the downloads from UrlBuilder.downloadData.
+
+        `base`: The unmodified image which all the layers will be drawn to. See Merger.
+
+        `processes`: The number of processes mergeAll shares the layers between. 1 merges in this process.
+        """
+
+        self.processes = processes
+        super(MemoryMerger, self).__init__(None, base)
+
+    def load(self, base):
+        """
+        `Author`: Bill Clark
+
+        Opens the base image in memory, and starts the merged image as a copy of it. See Merger.load.
+
+        `base`: The base image, see openImage.
+
+        `return`: The base image, in RGBA mode.
+        """
+        ret = openImage(base)
+        self.trackedimage = ret.copy()
+        return ret
+
+    def merge(self, new):
+        """
+        `Author`: Bill Clark
+
+        Merges one layer into the image. See Merger.merge, this version doesn't save after each layer.
+
+        `new`: The layer, a path or image data.
+        """
+        self.trackedimage, counter = self.overlay(self.trackedimage, openImage(new))
+        self.changed += counter
+        self.mcount += 1
+        self.setStatus("{} images merged successfully.".format(self.mcount), self.mcount)
+
+    def mergeAll(self, *images):
+        """
+        `Author`: Bill Clark
+
+        Merges any number of layers into the image, in order. See Merger.mergeAll.
+
+        `images`: The layers, paths or image data.
+        """
+        if self.processes > 1 and len(images) > 1:
+            return self.mergeParallel(*images)
+        count = 0
+        for top in images:
+            self.trackedimage, counter = self.overlay(self.trackedimage, openImage(top))
+            self.changed += counter
+            count += 1
+            self.mcount += 1
+            self.setStatus("Merging {} of {} Images".format(count, len(images)))
+        self.setStatus("{} Images Merged Successfully.".format(self.mcount), self.mcount)
+
+    def mergeParallel(self, *images):
+        """
+        `Author`: Bill Clark
+
+        Merges the layers across a pool of processes, giving the same image as merging them in order. The layers
+        are cut into one run per process, and each process decodes its run and merges it onto a copy of the base.
+        A pixel of that partial image differs from the base only where a layer of the run did, and then holds the
+        last such layer's pixel, so merging the partial images in run order is the same as merging every layer in
+        order. Decoding, the bulk of the work, is spread across the processes, and this process only merges one
+        partial image per run. Helper method to mergeAll.
+
+        `images`: The layers, paths or image data.
+        """
+        runs = min(self.processes, len(images))
+        size = len(images) // runs
+        extra = len(images) % runs
+        base = self.baseimage.tobytes()
+        tasks = []
+        start = 0
+        for run in xrange(runs):
+            end = start + size + (run < extra)
+            tasks.append((self.baseimage.size, base, images[start:end]))
+            start = end
+
+        pool = Pool(runs)
+        try:
+            count = 0
+            for partial, changed in pool.imap(mergeRun, tasks):
+                partialimage = Image.frombytes("RGBA", self.baseimage.size, partial)
+                self.trackedimage, counter = self.overlay(self.trackedimage, partialimage)
+                self.changed += changed
+                count += 1
+                self.setStatus("Merged {} of {} Runs of Images".format(count, runs))
+        finally:
+            pool.close()
+            pool.join()
+        self.mcount += len(images)
+        self.setStatus("{} Images Merged Successfully.".format(self.mcount), self.mcount)
+
+    def blkDiff(self, images):
+        """
+        `Author`: Bill Clark
+
+        Marks the pixels of a layer that differ from the base in black. See Merger.blkDiff.
+
+        `images`: The image to compare to base, a path or image data.
+        """
+        self.trackedimage, counter = self.overlay(self.trackedimage, openImage(images), (0,0,0,255))
+
+    def save(self, outfile):
+        """
+        `Author`: Bill Clark
+
+        Writes the merged image.
+
+        `outfile`: The file address to save the output file to.
+
+        `return`: The outfile.
+        """
+        self.trackedimage.save(outfile)
+        return outfile
+
+
+def openImage(source):
+    """
+    `Author`: Bill Clark
+
+    Opens an image and converts it to RGBA, in memory. Used wherever an image may come as a path or as the data
+    downloaded for it, by MemoryMerger and Rasterizer.
+
+    `source`: A file path, the data of an image file, or a PIL image. Data is told from a path by the null bytes
+              every image format has and no path can.
+
+    `return`: A new image in RGBA mode.
+    """
+    if isinstance(source, Image.Image):
+        opened = source
+    elif '\0' in source:
+        opened = Image.open(StringIO(source))
+    else:
+        opened = Image.open(source)
+    return opened.convert("RGBA")
+
+
+def mergeRun(task):
+    """
+    `Author`: Bill Clark
+
+    Merges one run of layers onto the base in a worker process. At module level so the pool can find it. Helper
+    function to MemoryMerger.mergeParallel.
+
+    `task`: A tuple of the base's size, the base as RGBA bytes, and the run of layers.
+
+    `return`: A tuple of the merged run as RGBA bytes and the pixels its layers changed.
+    """
+    size, base, images = task
+    merger = MemoryMerger(Image.frombytes("RGBA", size, base))
+    merger.mergeAll(*images)
+    return merger.trackedimage.tobytes(), merger.changed
+
 if __name__ == "__main__":
     diffnum = 120
     debug = 1
@@ -0,0 +1,113 @@
+from PIL import ImageDraw
+from GeometricDataStructures.Mercator import MercatorProjection
+from Observations.Observer import Observable
+from ImageMerge import openImage
+
+COLORS = {"blue": (0, 0, 255, 255), "red": (255, 0, 0, 255), "yellow": (255, 255, 0, 255)}
+
+
+class Rasterizer(Observable):
+
+    def __init__(self, center, zoom, width, height=0):
+        """
+        `Author`: Bill Clark
+
+        Draws geometrics straight onto a static maps base image, in place of sending them to google as url paths
+        and merging the images that come back. The geometrics are projected with the MercatorProjection for the
+        same center and zoom as the base, so they line up with it. One base image, which the ImageCache can hold,
+        replaces a download and a merge for every url, and a cached base renders without a connection.
+
+        `center`: The center of the image, a LatLongPoint.
+
+        `zoom`: The zoom of the image.
+
+        `width`: The width of the image in pixels.
+
+        `height`: The height of the image in pixels. 0 for the same as width, as with UrlBuilder.
+        """
+        super(Rasterizer, self).__init__()
+        self.projection = MercatorProjection()
+        self.zoom = zoom
+        self.width = width
+        self.height = height or width
+        xs, ys = self.projection.from_lat_lng_arrays_to_points([center.lat], [center.lng], zoom)
+        self.left = xs[0] - self.width / 2.0
+        self.top = ys[0] - self.height / 2.0
+        self.paths = []  # Tuples of a color and the pixel points of a line, drawn in order.
+        self.markers = []  # Tuples of a color and a pixel point.
+        self.setStatus('Initialized.')
+
+    def addGeometrics(self, geometrics, bounds=None):
+        """
+        `Author`: Bill Clark
+
+        Adds the paths of a list of geometrics, as UrlBuilder.addGeometrics does. Linestrings are drawn in red,
+        Polygons in blue, and points are left out. All the geometrics are projected in one batch call.
+
+        `geometrics`: A list of geometrics from a KmlFasade, or a GeometricIndex over them.
+
+        `bounds`: A west, south, east, north rectangle. When given with an index, only the geometrics the index
+                  finds in it are added.
+        """
+        if bounds is not None and hasattr(geometrics, 'query'):
+            geometrics = geometrics.query(bounds)
+        drawn = [element for element in geometrics
+                 if element.tag in ("Polygon", "LineString") and len(element.coordinates)]
+        self.projection.project_geometrics(drawn, self.zoom)
+        for element in drawn:
+            xs, ys = element.pixels[self.zoom]
+            points = [(x - self.left, y - self.top) for x, y in zip(xs, ys)]
+            self.paths.append((COLORS["blue"] if element.tag == "Polygon" else COLORS["red"], points))
+        self.setStatus('{} Paths Added.'.format(len(self.paths)))
+
+    def addMarker(self, point, color="yellow"):
+        """
+        `Author`: Bill Clark
+
+        Adds a marker at a point, drawn as a dot rather than google's pin.
+
+        `point`: The LatLongPoint to mark.
+
+        `color`: The name of the marker's color, one of COLORS.
+        """
+        xs, ys = self.projection.from_lat_lng_arrays_to_points([point.lat], [point.lng], self.zoom)
+        self.markers.append((COLORS[color], (xs[0] - self.left, ys[0] - self.top)))
+
+    def render(self, base, weight=5):
+        """
+        `Author`: Bill Clark
+
+        Draws the paths and markers over a copy of the base image.
+
+        `base`: The base image, a file path, the data of an image file, or a PIL image. See ImageMerge.openImage.
+
+        `weight`: The width of the paths in pixels, 5 as in UrlBuilder.addGeometrics.
+
+        `return`: The drawn image, in RGBA mode.
+        """
+        image = openImage(base)
+        draw = ImageDraw.Draw(image)
+        for color, points in self.paths:
+            if len(points) > 1:
+                draw.line(points, fill=color, width=weight, joint="curve")
+        for color, (x, y) in self.markers:
+            draw.ellipse([x - weight, y - weight, x + weight, y + weight], fill=color, outline=(0, 0, 0, 255))
+        self.setStatus('{} Paths Drawn.'.format(len(self.paths)))
+        return image
+
+    def save(self, base, outfile, weight=5):
+        """
+        `Author`: Bill Clark
+
+        Renders over the base image and writes the result.
+
+        `base`: The base image, see render.
+
+        `outfile`: The file address to save the output file to.
+
+        `weight`: The width of the paths in pixels.
+
+        `return`: The outfile.
+        """
+        self.render(base, weight).save(outfile)
+        return outfile
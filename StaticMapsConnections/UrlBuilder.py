@@ -1,11 +1,11 @@
-from urllib import urlretrieve
-from time import sleep
+from urllib import urlretrieve, quote
 from Observations.Observer import Observable
+from Downloader import Downloader
 
 
 class UrlBuilder(Observable):
 
-    def __init__(self, height, width=0):
+    def __init__(self, height, width=0, encode=0, cache=None):
         """
         `Author`: Bill Clark
 
@@ -15,6 +15,10 @@ class UrlBuilder(Observable):
         All inputs will be need to be converted to Long Lat, as all other files use Lat Long.
 
         `size`: the size of the returned image in pixels. [0-640]x[0-640]
+
+        `encode`: flag to write paths as encoded polylines by default, see addpath.
+
+        `cache`: An ImageCache for the downloads to be answered from. Optional.
         """
 
         super(UrlBuilder, self).__init__()
@@ -24,8 +28,11 @@ class UrlBuilder(Observable):
         self.urlbase += 'size='+repr(height) + "x" + repr(height) if width == 0 else repr(width)
         self.url = self.urlbase
         self.urllist = []
+        self.counted = (None, 0)  # The last url counted and its count, see currentCount.
         self.limit = 2000 #Proper limit is 2048, buffer of 48. Url can only be that many characters.
         self.debug = 0
+        self.encode = encode
+        self.cache = cache
 
     def addparam(self, feature, value):
         """
@@ -106,18 +113,13 @@ class UrlBuilder(Observable):
         `return`: the url with the given parameter appended to it. Also updates saved url.
         """
 
-        curr = self.url[:]
-        curr += '&&visible='
+        start = '&&visible='
         if type(viewports) is list:
-            for coordin in viewports:
-                curr += coordin
-                if self.retireUrl(curr):
-                    curr = self.url + '&&visible='
-                    curr += coordin + '|'
-                else:
-                    curr += '|'
-            curr = curr[:-1]
-        elif type(viewports) is str:
+            self.appendList(start, viewports)
+            return self.url
+
+        curr = self.url + start
+        if type(viewports) is str:
             curr += (viewports)
 
         self.url = curr
@@ -131,7 +133,8 @@ class UrlBuilder(Observable):
         Adds the locations listed as markers to the url. Each point will have the supplied style settings. If the
         parameters are provided as a list, when a coordinate is added and the length is pushed over the character limit,
         the url will be split. If the locations are provided as a solid string, the url will only be checked after
-        everything is appended. (This could cause data loss.)
+        everything is appended. (This could cause data loss.) Markers are always written as a list, the static maps
+        api only reads encoded polylines in paths.
 
         `styles`: Style settings, which function like parameters, a dict of name and value.
                         Valid Names: size | label | color
@@ -141,31 +144,22 @@ class UrlBuilder(Observable):
         `return`: the url with the given parameter appended to it. Also updates saved url.
         """
 
-        curr = self.url[:]
-        curr += '&&markers='
-
+        start = '&&markers='
         for key in styles:
-            curr += key + ':' + styles[key] + '|'
+            start += key + ':' + styles[key] + '|'
 
         if type(locations) is list:
-            for coordin in locations:
-                curr += coordin
-                if self.retireUrl(curr):
-                    curr = self.url + '&&markers='
-                    for key in styles:
-                        curr += key + ':' + styles[key] + '|'
-                    curr += coordin + '|'
-                else:
-                    curr += '|'
-            curr = curr[:-1]
-        elif type(locations) is str:
+            return self.appendList(start, locations)
+
+        curr = self.url + start
+        if type(locations) is str:
             curr += (locations)
 
         self.url = curr
         self.retireUrl(self.url)
         return curr
 
-    def addpath(self, styles, locations):
+    def addpath(self, styles, locations, encode=None):
         """
         `Author`: Bill Clark
 
@@ -175,40 +169,161 @@ class UrlBuilder(Observable):
         If the parameters are provided as a list, when a coordinate is added and the length is pushed over the
         character limit, the url will be split. If the locations are provided as a solid string, the url will only be
         checked after everything is appended. (This could cause data loss.)
+        A list can be written as an encoded polyline instead, see addEncodedPath.
 
         `styles`: Style settings, which function like parameters, a dict of name and value.
                         Valid Names: weight | geodesic | color | fillcolor
                         Valid value: [0-.] | T or F | [hexvalue] or [hexvalue32] or color name | same as color
         `locations`: Locations in a list format. Each will be added to be marked. list of coordinates.
 
+        `encode`: flag to write the list as an encoded polyline. Defaults to the flag given to the constructor.
+
         `return`: the url with the given parameter appended to it. Also updates saved url.
         """
 
-        curr = self.url[:]
-        curr += '&&path='
+        if encode is None: encode = self.encode
+        if encode and type(locations) is list:
+            return self.addEncodedPath(styles, locations)
 
+        start = '&&path='
         for key in styles:
-            curr += key + ':' + styles[key] + '|'
+            start += key + ':' + styles[key] + '|'
 
         if type(locations) is list:
-            for coordin in locations:
-                curr += coordin
-                if self.retireUrl(curr):
-                    curr = self.url + "&&path="
-                    for key in styles:
-                        curr += key + ':' + styles[key] + '|'
-                    curr += coordin + '|'
-                else:
-                    curr += "|"
-            curr = curr[:-1]
-        elif type(locations) is str:
+            return self.appendList(start, locations)
+
+        curr = self.url + start
+        if type(locations) is str:
             curr += (locations)
 
         self.url = curr
         self.retireUrl(self.url)
         return curr
 
-    def addGeometrics(self, geometrics):
+    def appendList(self, start, locations):
+        """
+        `Author`: Bill Clark
+
+        Appends a parameter made of a list of locations, splitting the url whenever it reaches the limit. The
+        parameter is restarted in the new url from the location that filled the old one. The url is kept as a list
+        of segments joined once at the end, and its count is kept running instead of recounting the url after each
+        location, so the work is linear in the number of locations. Used by addpath, addmarkers and viewportparam.
+
+        `start`: The start of the parameter, its name and any styles. &&path=color:blue| for example.
+
+        `locations`: The locations, a list of strings.
+
+        `return`: The url with the parameter appended. Also updates saved url.
+        """
+
+        startCount = self.countUrl(start)
+        parts = [self.url, start]
+        count = self.currentCount() + startCount
+        for coordin in locations:
+            parts.append(coordin)
+            coordinCount = self.countUrl(coordin)
+            count += coordinCount
+            if count >= self.limit:
+                self.urllist.append(''.join(parts))
+                self.url = self.urlbase[:]
+                parts = [self.url, start, coordin, '|']
+                count = self.currentCount() + startCount + coordinCount + 3
+            else:
+                parts.append('|')
+                count += 3
+
+        curr = ''.join(parts)
+        count -= self.countUrl(curr[-1:])
+        curr = curr[:-1]
+
+        self.url = curr
+        self.retireUrl(self.url, count=count)
+        return curr
+
+    def currentCount(self):
+        """
+        `Author`: Bill Clark
+
+        Counts the current url, remembering the answer so a url that hasn't changed since isn't counted again.
+
+        `return`: The count of the current url, see countUrl.
+        """
+
+        if self.counted[0] is not self.url:
+            self.counted = (self.url, self.countUrl(self.url))
+        return self.counted[1]
+
+    def addEncodedPath(self, styles, locations):
+        """
+        `Author`: Bill Clark
+
+        Adds the path listed to the url in google's encoded polyline format, enc:, where each point after the first
+        is a few characters of offset from the one before. Much more of a path fits in a url than with the lat,lng|
+        list. The encoding is url quoted, and the quoted length is what counts towards the limit. When the next
+        point would push the url over the limit the url is split, and the new one starts again from the last point
+        written, encoded in full, so the path stays joined across images.
+
+        `styles`: Style settings, see addpath.
+
+        `locations`: Locations in a list format, lat,lng strings.
+
+        `return`: the url with the path appended to it. Also updates saved url.
+        """
+
+        start = '&&path='
+        for key in styles:
+            start += key + ':' + styles[key] + '|'
+        start += 'enc:'
+
+        parts = [self.url, start]
+        count = self.currentCount() + self.countUrl(start)
+        last = None
+        for coordin in locations:
+            lat, lng = coordin.split(',')
+            point = (int(round(float(lat) * 1e5)), int(round(float(lng) * 1e5)))
+            chunk = self.encodePoint(point, last)
+            if count + len(chunk) >= self.limit:
+                self.urllist.append(''.join(parts) if last is not None else self.url)  # Without an empty path.
+                self.url = self.urlbase[:]
+                first = start + (self.encodePoint(last, None) if last is not None else '')
+                parts = [self.url, first]
+                count = self.currentCount() + self.countUrl(first)
+                chunk = self.encodePoint(point, last)
+            parts.append(chunk)
+            count += len(chunk)
+            last = point
+
+        curr = ''.join(parts)
+        self.url = curr
+        self.retireUrl(self.url, count=count)
+        return curr
+
+    def encodePoint(self, point, last=None):
+        """
+        `Author`: Bill Clark
+
+        Encodes one point of an encoded polyline. Each of the lat and lng is the offset from the last point, in
+        units of 1e-5 degrees, zigzagged to be positive and written five bits to a character. Helper to
+        addEncodedPath.
+
+        `point`: The point as a tuple of lat and lng integers, in units of 1e-5 degrees.
+
+        `last`: The point before it in the same form, or None for the first point of a path.
+
+        `return`: The encoded characters, url quoted.
+        """
+
+        ret = ''
+        for i in (0, 1):
+            value = point[i] - last[i] if last is not None else point[i]
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                ret += chr((0x20 | (value & 0x1f)) + 63)
+                value >>= 5
+            ret += chr(value + 63)
+        return quote(ret, safe='~')
+
+    def addGeometrics(self, geometrics, bounds=None, pack=0):
         """
         `Author`: Bill Clark
 
@@ -216,44 +331,223 @@ class UrlBuilder(Observable):
         Points are  NOT included, the line is commented out. Linestrings are drawn in red, Polygons in blue, and
         if markers are uncommented they will be yellow.
 
-        `geometrics`: A list of geometrics from a KmlFasade.
+        `geometrics`: A list of geometrics from a KmlFasade, or a GeometricIndex over them.
+
+        `bounds`: A west, south, east, north rectangle. When given with an index, only the geometrics the index
+                  finds in it are added.
+
+        `pack`: flag to lay the paths out with packPaths, in as few urls as will hold them, rather than in order.
         """
+        if bounds is not None and hasattr(geometrics, 'query'):
+            geometrics = geometrics.query(bounds)
         markerlist = []
+        paths = []
         for element in geometrics:
             if element.tag == "Point":
                 markerlist.append(element.printCoordinates())
             if element.tag == "Polygon":
-                self.addpath({"color": "blue", "weight": '5'}, element.coordinatesAsListStrings())
+                paths.append(({"color": "blue", "weight": '5'}, element.coordinatesAsListStrings()))
             if element.tag == "LineString":
-                self.addpath({"color": "red", "weight": '5'}, element.coordinatesAsListStrings())
+                paths.append(({"color": "red", "weight": '5'}, element.coordinatesAsListStrings()))
+
+        if pack:
+            self.packPaths(paths)
+        else:
+            for styles, locations in paths:
+                self.addpath(styles, locations)
         #self.addmarkers({"color": "yellow"}, markerlist)
 
-    def download(self, path="""Inputs\Static Maps\Mass\{} {}.png""", prefix='image'):
+    def packPaths(self, paths, encode=None):
+        """
+        `Author`: Bill Clark
+
+        Lays out a set of paths in as few urls as possible. Where addpath splits a url as soon as the next path
+        runs it over the limit, here every path is known up front. Paths too long for any url are cut into url
+        sized pieces, joined at a shared point the way addpath splits them. Then the pieces are placed first fit
+        decreasing, largest first into the first url with room. The current url counts as one with its room
+        already part used. The url left with the most room becomes the current url, for whatever is added next.
+        addpath already fills each url before splitting, so the layout in order is often as short. When packing
+        doesn't beat it, the paths are added in order instead. How many urls were saved is reported through
+        setStatus.
+
+        `paths`: A list of tuples of styles and locations, as given to addpath.
+
+        `encode`: flag to write the paths as encoded polylines. Defaults to the flag given to the constructor.
+
+        `return`: The number of urls saved.
+        """
+        if encode is None: encode = self.encode
+        greedy = self.greedyCount(paths, encode)
+
+        baseCount = self.countUrl(self.urlbase)
+        pieces = []
+        for order, (styles, locations) in enumerate(paths):
+            if not locations: continue
+            start = '&&path='
+            for key in styles:
+                start += key + ':' + styles[key] + '|'
+            if encode:
+                start += 'enc:'
+                points = []
+                for coordin in locations:
+                    lat, lng = coordin.split(',')
+                    points.append((int(round(float(lat) * 1e5)), int(round(float(lng) * 1e5))))
+                firsts = [self.encodePoint(point) for point in points]
+                nexts = [''] + [self.encodePoint(points[i], points[i - 1]) for i in xrange(1, len(points))]
+            else:
+                firsts = locations
+                nexts = [''] + ['|' + coordin for coordin in locations[1:]]
+            pieces.extend(self.cutPath(order, start, firsts, nexts, self.limit - baseCount))
+
+        bins = [[self.currentCount(), [self.url]]]
+        for cost, order, text in sorted(pieces, key=lambda piece: (-piece[0], piece[1])):
+            for room in bins:
+                if room[0] + cost < self.limit:
+                    break
+            else:
+                room = [baseCount, [self.urlbase]]
+                bins.append(room)
+            room[0] += cost
+            room[1].append((order, text))
+
+        if greedy <= len(bins):
+            for styles, locations in paths:
+                self.addpath(styles, locations, encode)
+            self.setStatus('Packing {} paths saved no urls, added them in order.'.format(len(paths)))
+            return 0
+
+        urls = [(used, contents[0] + ''.join(text for order, text in sorted(contents[1:])))
+                for used, contents in bins]
+        current = min(xrange(len(urls)), key=lambda i: urls[i][0])
+        for i, (used, url) in enumerate(urls):
+            if not i == current:
+                self.urllist.append(url)
+        self.url = urls[current][1]
+        self.counted = (self.url, urls[current][0])
+
+        saved = greedy - len(urls)
+        self.setStatus('Packed {} paths into {} urls, {} fewer than in order.'.format(len(paths), len(urls), saved))
+        return saved
+
+    def cutPath(self, order, start, firsts, nexts, room):
+        """
+        `Author`: Bill Clark
+
+        Cuts a path into pieces that each fit in a url by themselves. Each piece ends at the point the next one
+        starts from. Helper to packPaths.
+
+        `order`: The position of the path, kept with its pieces so a url writes its paths in the order given.
+
+        `start`: The path parameter up to its first point, &&path= and the styles.
+
+        `firsts`: Each point written as the first of a path.
+
+        `nexts`: Each point written following the one before it. The first is unused.
+
+        `room`: The count a piece must stay below, the limit less the base url.
+
+        `return`: A list of pieces, tuples of their count, the order, and their text.
+        """
+        ret = []
+        startCount = self.countUrl(start)
+        first = 0
+        count = startCount + self.countUrl(firsts[0])
+        parts = [start, firsts[0]]
+        for i in xrange(1, len(firsts)):
+            nextCount = self.countUrl(nexts[i])
+            if count + nextCount >= room and i - 1 > first:
+                ret.append((count, order, ''.join(parts)))
+                first = i - 1
+                count = startCount + self.countUrl(firsts[first])
+                parts = [start, firsts[first]]
+            parts.append(nexts[i])
+            count += nextCount
+        ret.append((count, order, ''.join(parts)))
+        return ret
+
+    def greedyCount(self, paths, encode):
+        """
+        `Author`: Bill Clark
+
+        Counts the urls the paths would take if added in order by addpath, on a scratch builder with this one's
+        urls, so nothing here changes. Helper to packPaths.
+
+        `paths`: A list of tuples of styles and locations.
+
+        `encode`: flag to encode the paths.
+
+        `return`: The number of urls, including the current one.
+        """
+        scratch = UrlBuilder(0, encode=encode)
+        scratch.urlbase = self.urlbase
+        scratch.url = self.url
+        scratch.limit = self.limit
+        for styles, locations in paths:
+            scratch.addpath(styles, locations)
+        return len(scratch.urllist) + 1
+
+    def download(self, path="""Inputs\Static Maps\Mass\{} {}.png""", prefix='image', workers=4, rate=None):
         """
         `Author`: Bill Clark
 
         Takes a parameter path and downloads the generated url to that path. Using the symbol {} {} twice will replace
         the first with the given prefix, and the second with a counter. This is the recommended way of using this path,
-        because mulitple urls may be downloaded.
+        because mulitple urls may be downloaded. The urls are downloaded at once by a Downloader, which reports its
+        progress to this object's observers. With a cache, only the urls it doesn't hold are downloaded.
 
         `path`: a file path to save the generated image to.
 
         `prefix`: The prefix to the count in the file name. Defaults to image.
 
+        `workers`: The number of images downloaded at once.
+
+        `rate`: The most requests to start a second. None for no limit.
+
         `return`: A list of the file locations for the downloaded files.
         """
 
-        ret = []
-        count = 1
-        ret.append(urlretrieve(self.urlbase, path.format(prefix, '0'))[0])
-        for url in self.urllist:
-            ret.append(urlretrieve(url, path.format(prefix, repr(count)))[0])
-            count += 1
-            self.setStatus('Downloaded {} of {} Images.'.format(count, len(self.urllist)+2))
-            sleep(.3)
-        ret.append(urlretrieve(self.url, path.format(prefix, repr(count)))[0])
-        self.dcount = count+1
-        self.setStatus('Downloaded {} Images Successfully.'.format(self.dcount+1))
+        urls = [self.urlbase] + self.urllist + [self.url]
+        ret = [path.format(prefix, repr(count)) for count in xrange(len(urls))]
+        jobs = [(url, file) for url, file in zip(urls, ret) if self.cache is None or not self.cache.get(url, file)]
+        downloader = Downloader(workers, rate)
+        for observer in self.observers:
+            downloader.register(observer)
+        downloader.download(jobs)
+        if self.cache is not None:
+            for url, file in jobs:
+                self.cache.put(url, file)
+        self.dcount = len(jobs)
+        self.setStatus('Downloaded {} Images Successfully, {} from the cache.'.format(self.dcount,
+                                                                                      len(ret) - len(jobs)))
+        return ret
+
+    def downloadData(self, workers=4, rate=None):
+        """
+        `Author`: Bill Clark
+
+        The in memory version of download. The images are kept as the data the server sent, nothing is written
+        but the cache, if there is one. Made to be handed straight to a MemoryMerger.
+
+        `workers`: The number of images downloaded at once.
+
+        `rate`: The most requests to start a second. None for no limit.
+
+        `return`: A list of the image data, the base url's first.
+        """
+
+        urls = [self.urlbase] + self.urllist + [self.url]
+        ret = [self.cache.read(url) if self.cache is not None else None for url in urls]
+        missing = [i for i in xrange(len(urls)) if ret[i] is None]
+        downloader = Downloader(workers, rate)
+        for observer in self.observers:
+            downloader.register(observer)
+        for i, data in zip(missing, downloader.download([(urls[i], None) for i in missing])):
+            ret[i] = data
+            if self.cache is not None:
+                self.cache.write(urls[i], data)
+        self.dcount = len(missing)
+        self.setStatus('Downloaded {} Images Successfully, {} from the cache.'.format(self.dcount,
+                                                                                      len(ret) - len(missing)))
         return ret
 
     def downloadBase(self, path='Inputs\Static Maps\\Mass\{} 0.png', prefix='image'):
@@ -261,7 +555,7 @@ class UrlBuilder(Observable):
         `Author`: Bill Clark
 
         Downloads only the base url. The generator method does not download that url (better for automation), so this
-        method was a required addition.
+        method was a required addition. Answered from the cache when it holds the image.
 
         `path`: a file path to save the generated image to.
 
@@ -270,7 +564,36 @@ class UrlBuilder(Observable):
         'return' the base url's saved location.
         """
 
-        return urlretrieve(self.urlbase, path.format(prefix, '0'))[0]
+        file = path.format(prefix, '0')
+        if self.cache is not None and self.cache.get(self.urlbase, file):
+            return file
+        urlretrieve(self.urlbase, file)
+        if self.cache is not None:
+            self.cache.put(self.urlbase, file)
+        return file
+
+    def downloadBaseData(self):
+        """
+        `Author`: Bill Clark
+
+        The in memory version of downloadBase, for drawing on with a Rasterizer. Answered from the cache when it
+        holds the image, so a cached base needs no connection. Progress is reported to this object's observers, as
+        downloadData does.
+
+        `return`: The base image's data.
+        """
+
+        data = self.cache.read(self.urlbase) if self.cache is not None else None
+        cached = data is not None
+        if not cached:
+            downloader = Downloader(1)
+            for observer in self.observers:
+                downloader.register(observer)
+            data = downloader.download([(self.urlbase, None)])[0]
+            if self.cache is not None:
+                self.cache.write(self.urlbase, data)
+        self.setStatus('Downloaded {} Images Successfully, {} from the cache.'.format(int(not cached), int(cached)))
+        return data
 
     def countUrl(self, url):
         """
@@ -285,13 +608,9 @@ class UrlBuilder(Observable):
         `return`: returns the number of characters in the url.
         """
 
-        ret = 0
-        for character in url:
-            if character == "|": ret += 3
-            else: ret += 1
-        return ret
+        return len(url) + 2 * url.count('|')
 
-    def retireUrl(self, url, offset=0):
+    def retireUrl(self, url, offset=0, count=None):
         """
         `Author`: Bill Clark
 
@@ -303,13 +622,17 @@ class UrlBuilder(Observable):
         both, but you get the idea.) The method returns false if the url is shorter than the limit.
 
         `url`: The url to check the length of.
+
+        `count`: The count of the url, when the caller already knows it. Saves counting it again.
         """
-        count = self.countUrl(url)+offset
+        if count is None: count = self.countUrl(url)
+        count += offset
         if count >= self.limit:
             self.urllist.append(url)
             self.url = self.urlbase[:]
             return 1
         else:
+            self.counted = (url, count - offset)
             return 0
 
     def printUrls(self, prin=0):
@@ -1,4 +1,7 @@
 import ImageMerge
 import UrlBuilder
+import Downloader
+import ImageCache
+import Rasterizer
 
-__all__ = ["UrlBuilder", "ImageMerge"]
+__all__ = ["UrlBuilder", "ImageMerge", "Downloader", "ImageCache", "Rasterizer"]
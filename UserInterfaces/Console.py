@@ -1,12 +1,19 @@
 import sys
+import csv
+import json
+from multiprocessing import Pool
 from PIL import Image
 import StaticMapsConnections.ImageMerge as ImageMerge
 from GeometricDataStructures.KmlFasade import KmlFasade
 from GeometricDataStructures.Mercator import *
 from GeometricDataStructures.KmlComposite import KmlComposite
+from GeometricDataStructures.SpatialIndex import viewportBounds
 from RestrictionEngine.RestrictionEngine import RestrictionFactory
 from StaticMapsConnections.UrlBuilder import UrlBuilder
+from StaticMapsConnections.ImageCache import ImageCache
+from StaticMapsConnections.Rasterizer import Rasterizer
 from Observations.ObservableConsole import ObservableConsole
+from Observations.Instrumentation import Instrumentation
 
 class Parser():
     def __init__(self):
@@ -16,19 +23,35 @@ class Parser():
         This class parses command line switches. A variety are supported, and can be parsed
         as flags with their data, or as the argv array provided by the sys module.
         Switches: wa - use weiler atherton clipping.
+                  rc - use rectangle clipping, quicker than wa and splits lines that leave the viewport.
                   w - rewrite changes back to the file.
                   sr - use a square restriction.
                   m - use the static maps connections, to generate urls and merge the images.
                   c - set the center point for the viewport and restrictions.
                   z - set the zoom value for google static.
                   s - set the size for google static.
+                  sp - simplify lines and rings, dropping vertices within the given number of pixels at the zoom.
                   v - verbose output to the console.
-                  co - paired with the number of kml files provided, allows for multi file functionality.
+                  co - paired with the number of kml files provided, allows for multi file functionality. Each file
+                       is run in its own process, and w is the folder the files are rewritten into.
                   h - exports the metadata to outputs\metadata
+                  st - stream the kml one placemark at a time, for files too large for memory. Requires w.
+                  ca - store coordinates in compact arrays instead of point objects, for large files.
+                  ix - build a spatial index, restrictions and urls only visit geometrics in the viewport.
+                  en - write url paths as encoded polylines, fewer urls and images to merge.
+                  pk - pack the url paths into as few urls as possible, rather than adding them in order.
+                  ic - cache downloaded images, a repeated url is read from disk instead of downloaded.
+                  mp - merge the images across the given number of processes.
+                  lr - draw the geometrics locally onto the base image, only the base is downloaded.
+                  bt - run every job of a csv or json manifest of centers, zooms, sizes and outputs. Replaces c, z,
+                       s and w, the kml is parsed once and each job clips it without changing it.
+                  bp - the number of processes the batch jobs or co files are shared between.
+                  ti - print the time, cpu, peak memory and counts of each stage of the run when it's done.
+                  tj - export the same measurements as json to the given path.
         Example arg list.
         -c 1 -wa -w "Outputs/Console Rewrite.kml" -h -m Outputs/Outfile.png -z 8 -c 40.0583,-74.4057 -s 600 -v "Inputs/KML Files/us_states.kml"        """
-        self.switches = {'wa':0, 'v':0, 'h':0,  'sr':0}
-        self.data = {'w':0, 'm':0, 'c':0, 'z':0, 's':0, 'co':0}
+        self.switches = {'wa':0, 'rc':0, 'v':0, 'h':0,  'sr':0, 'st':0, 'ca':0, 'ix':0, 'en':0, 'pk':0, 'ic':0, 'lr':0, 'ti':0}
+        self.data = {'w':0, 'm':0, 'c':0, 'z':0, 's':0, 'co':0, 'sp':0, 'mp':0, 'bt':0, 'bp':0, 'tj':0}
 
     def parse(self, flag, data):
         """
@@ -64,9 +87,15 @@ class Parser():
             else:
                 raise Exception
         #Switch checks
-        self.switches['wa'] = self.switches['wa'] and self.data['c'] and self.data['z'] and self.data['s']
-        self.switches['sr'] = self.switches['sr'] and self.data['c'] and self.data['z'] and self.data['s']
-        if not self.data['c']: self.switches['sr'] = 0
+        viewport = self.data['bt'] or (self.data['c'] and self.data['z'] and self.data['s'])
+        self.switches['wa'] = self.switches['wa'] and viewport
+        self.switches['sr'] = self.switches['sr'] and viewport
+        self.switches['rc'] = self.switches['rc'] and viewport
+        if not (self.data['c'] or self.data['bt']): self.switches['sr'] = 0
+        self.switches['st'] = self.switches['st'] and self.data['w'] and not self.data['co'] and not self.data['bt']
+        self.switches['ix'] = self.switches['ix'] and viewport and not self.switches['st']
+        if not (self.data['z'] or self.data['bt']): self.data['sp'] = 0
+        if self.data['co']: self.data['bt'] = 0
         if not (self.data['m'] and self.data['c'] and self.data['z'] and self.data['s']): self.data['m'] = 0
 
 
@@ -102,7 +131,7 @@ def interface(args=None, uiObserve=None, imObserve=None, urlObserve=None):
 
     parser = Parser()
     merc = MercatorProjection()
-    f = RestrictionFactory()
+    instrument = Instrumentation()
 
     # parse args.
     if not args: args = sys.argv[1:]
@@ -116,50 +145,130 @@ def interface(args=None, uiObserve=None, imObserve=None, urlObserve=None):
 
     # processes the data values in the switches, c, z, and s.
     if data['c']: center = LatLongPoint(float(data['c'].split(',')[0]),float(data['c'].split(',')[1]))
-    else:
+    elif not data['bt']:
         observe.setStatus('No center point. Cancelled restrictions and static maps.\n', 'ERROR')
     if data['z']: zoom = int(data['z'])
-    else:
+    elif not data['bt']:
         observe.setStatus('No zoom value. Cancelled wa restriction and static maps.\n', 'ERROR')
     if data['s']: size = int(data['s'])
-    else:
+    elif not data['bt']:
         observe.setStatus('No size has been specified. Cancelled wa restriction and static maps.\n', 'ERROR')
 
     if switches['v']: observe.setStatus('Values have been set.\n', 'CONSOLE')
 
-    # open the kml fasade.
-    if data['co']: fasade = KmlComposite(*[KmlFasade(file) for file in args[-(data['co']):]])
-    else: fasade = KmlFasade(args[-1])
-
-    fasade.processPlacemarks(switches['h'])
-    if switches['h'] and switches['v']: observe.setStatus('Metadata extracted.\n', 'CONSOLE')
+    # run a manifest of viewports over one parse of the kml.
+    if data['bt']:
+        instrument.begin('batch')
+        jobs = readManifest(data['bt'])
+        results = batch(args[-1], jobs, switches, data, int(data['bp']) if data['bp'] else 1, observe)
+        instrument.end(jobs=len(jobs), geometricsOut=sum(written for output, written in results))
+        if switches['v']: observe.setStatus('Batch completed.\n', 'CONSOLE')
+        report(instrument, switches, data, observe)
+        return
 
-    if data['w']: fasade.removeGarbageTags()
-    if switches['v']: observe.setStatus('Garbage data removed.\n', 'CONSOLE')
+    # open the kml fasade.
+    if data['co']: fasade = KmlComposite(*[KmlFasade(file, stream=1, compact=switches['ca'])
+                                           for file in args[-int(data['co']):]])
+    elif switches['st']: fasade = KmlFasade(args[-1], stream=1, compact=switches['ca'])
+    else:
+        instrument.begin('parse')
+        fasade = KmlFasade(args[-1], compact=switches['ca'])
+        instrument.end(placemarks=sum(1 for place in fasade.kmlRoot.iter(fasade.tags['Placemark'])))
+
+    restrict = restriction(switches, data, center if data['c'] else None, zoom if data['z'] else None,
+                           size if data['s'] else None)
+
+    if data['co']:
+        # parse, clip and rewrite every file at once, in worker processes.
+        instrument.begin('composite')
+        fasade.processAll(restrict, switches['h'], data['w'], switches['ix'], int(data['bp']) if data['bp'] else None)
+        instrument.end(files=len(fasade.fasades), geometricsOut=geometricCount(fasade),
+                       verticesOut=vertexCount(fasade))
+        if switches['v']: observe.setStatus('KML files processed.\n', 'CONSOLE')
+    elif switches['st']:
+        # stream, clip and rewrite in a single pass over the file.
+        instrument.begin('stream')
+        written = fasade.streamPlacemarks(data['w'], restrict, switches['h'], data['m'])
+        instrument.end(placemarksOut=written)
+        if switches['v']: observe.setStatus('KML file streamed and rewritten.\n', 'CONSOLE')
+    else:
+        instrument.begin('processPlacemarks')
+        fasade.processPlacemarks(switches['h'])
+        instrument.end(geometrics=geometricCount(fasade), vertices=vertexCount(fasade))
+        if switches['h'] and switches['v']: observe.setStatus('Metadata extracted.\n', 'CONSOLE')
+
+        if switches['ix']:
+            instrument.begin('index')
+            fasade.buildIndex()
+            instrument.end()
+        if switches['ix'] and switches['v']: observe.setStatus('Spatial index built.\n', 'CONSOLE')
+
+        if data['w']:
+            instrument.begin('removeGarbageTags')
+            fasade.removeGarbageTags()
+            instrument.end(garbage=len(fasade.garbage))
+        if switches['v']: observe.setStatus('Garbage data removed.\n', 'CONSOLE')
+
+        # clip if requested in the args.
+        if restrict is not None:
+            instrument.begin('clip')
+            vertices = vertexCount(fasade)
+            for geometrics in (fasade.yieldIndexes() if switches['ix'] else fasade.yieldGeometrics()):
+                restrict.restrict(geometrics)
+            fasade.fasadeUpdate()
+            instrument.end(verticesIn=vertices, verticesOut=vertexCount(fasade), geometricsOut=geometricCount(fasade))
+        if switches['v']: observe.setStatus('Clipping completed.\n', 'CONSOLE')
+
+        # rewrite if requested.
+        if data['w']:
+            instrument.begin('rewrite')
+            fasade.rewrite(data['w'])
+            instrument.end()
+        if switches['v']: observe.setStatus('KML file rewritten.\n', 'CONSOLE')
+
+    # Draws the geometrics onto a downloaded base image.
+    if data['m'] and switches['lr']:
+        instrument.begin('paths')
+        build = UrlBuilder(size, cache=ImageCache() if switches['ic'] else None)
+        if urlObserve is not None: build.register(urlObserve)
+        build.centerparams(data['c'], repr(zoom))
+        raster = Rasterizer(center, zoom, size)
+        if imObserve is not None: raster.register(imObserve)
 
-    # clip if requested in the args.
-    if switches['wa']:
-        restrict = f.newWAClipping(merc.get_corners(center, zoom, size, size))
-    if switches['sr']:
-        restrict = f.newSquareRestriction(merc.get_corners(center, zoom, size, size))
-    if switches['wa'] or switches['sr']:
-        for geometrics in fasade.yieldGeometrics():
-            restrict.restrict(geometrics)
-        fasade.fasadeUpdate()
-    if switches['v']: observe.setStatus('Clipping completed.\n', 'CONSOLE')
+        if switches['ix']:
+            for index in fasade.yieldIndexes():
+                raster.addGeometrics(index, viewportBounds(merc.get_corners(center, zoom, size, size)))
+        else:
+            for geometrics in fasade.yieldGeometrics():
+                raster.addGeometrics(geometrics)
 
-    # rewrite if requested.
-    if data['w']: fasade.rewrite(data['w'])
-    if switches['v']: observe.setStatus('KML file rewritten.\n', 'CONSOLE')
+        #Mark the center point.
+        raster.addMarker(center)
+
+        instrument.end(paths=len(raster.paths))
+        instrument.begin('download')
+        base = build.downloadBaseData()
+        instrument.end(images=1, bytes=len(base))
+        if switches['v']: observe.setStatus("Base image downloaded.\n", 'CONSOLE')
+        instrument.begin('render')
+        raster.save(base, data['m'])
+        instrument.end()
+        im = Image.open(data['m'])
+        if __name__ == "__main__": im.show()
 
     # Creates urls out of the geometrics, downloads and merges them.
-    if data['m']:
-        build = UrlBuilder(size)
+    elif data['m']:
+        instrument.begin('urls')
+        build = UrlBuilder(size, encode=switches['en'], cache=ImageCache() if switches['ic'] else None)
         if urlObserve is not None: build.register(urlObserve)
         build.centerparams(data['c'], repr(zoom))
 
-        for geometrics in fasade.yieldGeometrics():
-            build.addGeometrics(geometrics)
+        if switches['ix']:
+            for index in fasade.yieldIndexes():
+                build.addGeometrics(index, viewportBounds(merc.get_corners(center, zoom, size, size)), switches['pk'])
+        else:
+            for geometrics in fasade.yieldGeometrics():
+                build.addGeometrics(geometrics, pack=switches['pk'])
 
         #Mark the center point.
         build.addmarkers({"color": "yellow"}, repr(center))
@@ -168,14 +277,203 @@ def interface(args=None, uiObserve=None, imObserve=None, urlObserve=None):
         if switches['v']:
             observe.setStatus(build.printUrls(), 'URLS')
 
-        images = build.download()
+        instrument.end(urls=len(build.urllist) + 1)
+        instrument.begin('download')
+        images = build.downloadData()
+        instrument.end(images=len(images), downloaded=build.dcount, bytes=sum(len(image) for image in images))
         if switches['v']: observe.setStatus("All images downloaded.\n", 'CONSOLE')
-        merger = ImageMerge.Merger(data['m'], images[0])
+        instrument.begin('merge')
+        merger = ImageMerge.MemoryMerger(images[0], int(data['mp']) if data['mp'] else 1)
         if imObserve is not None: merger.register(imObserve)
-        images = merger.convertAll(*images)
-        merger.mergeAll(data['m'], *images)
+        merger.mergeAll(*images[1:])
+        merger.save(data['m'])
+        instrument.end(layers=len(images) - 1, pixelsChanged=merger.changed)
         im = Image.open(data['m'])
         if __name__ == "__main__": im.show()
 
+    report(instrument, switches, data, observe)
+
+
+def report(instrument, switches, data, observe):
+    """
+    `Author`: Bill Clark
+
+    Prints the measurements of a run and exports them, as the ti and tj switches ask.
+
+    `instrument`: The Instrumentation of the run.
+
+    `switches`: The switches from the Parser.
+
+    `data`: The data from the Parser.
+
+    `observe`: The ObservableConsole to print to.
+    """
+    if switches['ti']: observe.setStatus(instrument.summary() + '\n', 'CONSOLE')
+    if data['tj']: instrument.export(data['tj'])
+
+
+def geometricCount(fasade):
+    """
+    `Author`: Bill Clark
+
+    `fasade`: A KmlFasade or KmlComposite.
+
+    `return`: The number of geometrics it holds.
+    """
+    return sum(len(geometrics) for geometrics in fasade.yieldGeometrics())
+
+
+def vertexCount(fasade):
+    """
+    `Author`: Bill Clark
+
+    `fasade`: A KmlFasade or KmlComposite.
+
+    `return`: The number of coordinates in all of its geometrics.
+    """
+    return sum(len(x.coordinates) for geometrics in fasade.yieldGeometrics() for x in geometrics)
+
+def restriction(switches, data, center, zoom, size):
+    """
+    `Author`: Bill Clark
+
+    Makes the restriction the switches ask for, for one viewport. The clipping switches replace each other, rc
+    over sr over wa, and sp simplifies after whichever clips.
+
+    `switches`: The switches from the Parser.
+
+    `data`: The data from the Parser.
+
+    `center`: The center of the viewport, a LatLongPoint.
+
+    `zoom`: The zoom of the viewport.
+
+    `size`: The width and height of the viewport in pixels.
+
+    `return`: The restriction, None if no restriction was asked for.
+    """
+    f = RestrictionFactory()
+    if switches['wa'] or switches['sr'] or switches['rc']:
+        viewport = MercatorProjection().get_corners(center, zoom, size, size)
+    restrict = None
+    if switches['wa']:
+        restrict = f.newWAClipping(viewport)
+    if switches['sr']:
+        restrict = f.newSquareRestriction(viewport)
+    if switches['rc']:
+        restrict = f.newRectangleClipping(viewport)
+    if data['sp']:
+        simplify = f.newSimplification(zoom, float(data['sp']))
+        restrict = simplify if restrict is None else f.newComposite(restrict, simplify)
+    return restrict
+
+
+def readManifest(path):
+    """
+    `Author`: Bill Clark
+
+    Reads the jobs of a batch run. A .json manifest is a list of objects, anything else is read as a csv with a
+    header row. Either way each job has a center, as "lat,lng", a zoom, a size and an output path.
+
+    `path`: The path of the manifest.
+
+    `return`: A list of tuples of center LatLongPoint, zoom, size and output path.
+    """
+    with open(path, 'rb') as manifest:
+        if path.lower().endswith('.json'):
+            rows = json.load(manifest)
+        else:
+            rows = list(csv.DictReader(manifest))
+    ret = []
+    for row in rows:
+        lat, lng = str(row['center']).split(',')
+        ret.append((LatLongPoint(float(lat), float(lng)), int(row['zoom']), int(row['size']), str(row['output'])))
+    return ret
+
+
+batchFasade = None  # The parsed kml every batch job copies, set in each process by loadBatch.
+
+
+def loadBatch(path, switches):
+    """
+    `Author`: Bill Clark
+
+    Parses the kml of a batch run and makes its geometrics, once per process. Forked workers find the parent's
+    fasade already loaded and keep it. Used as the initializer of the batch pool.
+
+    `path`: The path of the kml file.
+
+    `switches`: The switches from the Parser.
+    """
+    global batchFasade
+    if batchFasade is not None and batchFasade.filepath == path:
+        return
+    batchFasade = KmlFasade(path, compact=switches['ca'])
+    batchFasade.processPlacemarks(switches['h'])
+    if switches['ix']: batchFasade.buildIndex()
+    batchFasade.removeGarbageTags()
+
+
+def runJob(job):
+    """
+    `Author`: Bill Clark
+
+    Runs one batch job, clipping the loaded fasade to the job's viewport without changing it and writing the
+    result out. Helper function to batch, at module level so the pool can find it.
+
+    `job`: A tuple of a manifest job, see readManifest, and the switches and data from the Parser.
+
+    `return`: A tuple of the output path and the number of geometrics written.
+    """
+    (center, zoom, size, output), switches, data = job
+    restrict = restriction(switches, data, center, zoom, size)
+    if restrict is None:
+        batchFasade.rewrite(output)
+        return output, len(batchFasade.geometrics)
+    result = restrict.clip(batchFasade.index if switches['ix'] else batchFasade.geometrics)
+    batchFasade.writeResult(result, output)
+    return output, len(result)
+
+
+def batch(path, jobs, switches, data, processes=1, observe=None):
+    """
+    `Author`: Bill Clark
+
+    Runs a batch of viewports over one kml file. The file is parsed and its geometrics made once, and each job
+    clips it without changing it, so no job sees another's clipping. With more than one process the jobs are
+    shared out across a pool, each worker loading the file once.
+
+    `path`: The path of the kml file.
+
+    `jobs`: The jobs from readManifest.
+
+    `switches`: The switches from the Parser.
+
+    `data`: The data from the Parser.
+
+    `processes`: The number of processes the jobs are shared between.
+
+    `observe`: An ObservableConsole to report each finished job to. Optional.
+
+    `return`: A list of tuples of each job's output path and number of geometrics written, in job order.
+    """
+    loadBatch(path, switches)
+    tasks = [(job, switches, data) for job in jobs]
+    pool = Pool(processes, loadBatch, (path, switches)) if processes > 1 and len(jobs) > 1 else None
+    try:
+        results = pool.imap(runJob, tasks) if pool is not None else (runJob(task) for task in tasks)
+        ret = []
+        for count, (output, written) in enumerate(results, 1):
+            ret.append((output, written))
+            if observe is not None and switches['v']:
+                observe.setStatus('Job {} of {} written to {}, {} geometrics.\n'.format(count, len(jobs), output,
+                                                                                         written), 'CONSOLE')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return ret
+
+
 if __name__ == "__main__":
     interface()